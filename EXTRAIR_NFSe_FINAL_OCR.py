@@ -8,9 +8,9 @@ V3.1.2 — Fix vRetCP + Python 3.14 WMI + Retenções Corretas + Interface Moder
 # FIX PYTHON 3.14 — DEVE SER O PRIMEIRO CÓDIGO DO SCRIPT
 # ═══════════════════════════════════════════════════════
 import sys
-import platform as _platform
 
 if sys.version_info >= (3, 14):
+    import platform as _platform
     if hasattr(_platform, '_wmi_query'):
         _orig_wmi = _platform._wmi_query
         def _safe_wmi_query(*args, **kwargs):
@@ -29,45 +29,132 @@ if sys.version_info >= (3, 14):
 # ═══════════════════════════════════════════════════════
 import os
 import re
+import csv
+import json
 import time
+import random
+import shutil
 import logging
 import threading
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import pandas as pd
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry as UrllibRetry
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.edge.service import Service
-from selenium.webdriver.edge.options import Options
-from selenium.common.exceptions import (
-    NoSuchElementException,
-    TimeoutException,
-    StaleElementReferenceException,
-)
-import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from queue import Queue
+import importlib
+import multiprocessing
+from collections import deque, namedtuple
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+
+class _Lazy:
+    """Módulo (ou atributo de módulo) importado só no primeiro uso."""
+
+    def __init__(self, modulo, attr=None):
+        self._alvo = (modulo, attr)
+        self._obj = None
+
+    def _carregar(self):
+        if self._obj is None:
+            modulo, attr = self._alvo
+            obj = importlib.import_module(modulo)
+            self._obj = getattr(obj, attr) if attr else obj
+        return self._obj
+
+    def __getattr__(self, nome):
+        return getattr(self._carregar(), nome)
+
+    def __call__(self, *args, **kwargs):
+        return self._carregar()(*args, **kwargs)
+
+
+# Dependências pesadas: "Gerar relatório" não carrega selenium e um
+# download sem relatório não carrega pandas/openpyxl.
+pd            = _Lazy("pandas")
+requests      = _Lazy("requests")
+HTTPAdapter   = _Lazy("requests.adapters", "HTTPAdapter")
+UrllibRetry   = _Lazy("urllib3.util.retry", "Retry")
+webdriver     = _Lazy("selenium.webdriver")
+By            = _Lazy("selenium.webdriver.common.by", "By")
+WebDriverWait = _Lazy("selenium.webdriver.support.ui", "WebDriverWait")
+EC            = _Lazy("selenium.webdriver.support.expected_conditions")
+Service       = _Lazy("selenium.webdriver.edge.service", "Service")
+Options       = _Lazy("selenium.webdriver.edge.options", "Options")
+_sel_exc      = _Lazy("selenium.common.exceptions")
+ET            = _Lazy("xml.etree.ElementTree")
+_lxml         = _Lazy("lxml.etree")
+sqlite3       = _Lazy("sqlite3")
 
 # ═══════════════════════════════════════════════════════
 # CONFIGURAÇÕES — VELOCIDADE MÁXIMA
 # ═══════════════════════════════════════════════════════
-CLICK_DELAY  = 0.15
+# Esperas por condição: valores são limites máximos, não pausas fixas
 POPUP_WAIT   = 1.8
-PAGE_WAIT    = 1.0
-FILTER_WAIT  = 1.2
+PAGE_WAIT    = 10
+FILTER_WAIT  = 15
+# Backoff adaptativo: só desacelera quando o portal mostra erro
+RITMO_MIN    = 0.5
 RETRY_WAIT   = 5
 MAX_RETRIES  = 3
 DL_WORKERS   = 8
 DL_TIMEOUT   = 15
+DL_CHUNK     = 64 * 1024
+DL_FILA      = DL_WORKERS * 4
 SESSION_POOL = 20
+# Motor de download: "threads" (requests + DL_WORKERS threads) ou "async"
+# (aiohttp num event loop próprio: uma thread, um pool de conexões)
+DL_MOTOR     = "threads"
+DL_ASYNC     = 32
+DL_POR_HOST  = 0       # requisições/s por host no motor async (0 = sem limite)
+REL_WORKERS  = max(1, (os.cpu_count() or 2) - 1)
+REL_CHUNK    = 200
+# Relatório em janelas: REL_LOTE linhas do log são lidas, extraídas, gravadas
+# e descartadas por vez — a memória não cresce com o tamanho do arquivo
+REL_LOTE     = 5_000
+
+# Cache de extração — incremente EXTRATOR_VERSAO ao mudar extrair_xml
+CACHE_REL       = "cache_relatorio.sqlite"
+MANIFESTO       = "manifesto.jsonl"
+EXTRATOR_VERSAO = "4"
+# Com relatório automático, cada XML é extraído assim que o download termina
+# (bytes em memória) e a linha vai para o cache — o Excel sai quase pronto.
+PIPELINE_PARSE  = True
+# Parser dos XMLs: "auto" (lxml se instalado), "lxml" ou "etree" (stdlib).
+# Os dois motores extraem exatamente os mesmos campos.
+XML_MOTOR       = "auto"
+
+# Valores monetários vão ao Excel como número com formato "#,##0.00" (o Excel
+# em pt-BR exibe #.##0,00). VALORES_TEXTO = True volta ao texto "1234,56"
+# de antes ("0" para tag ausente, "0,00" para um 0.00 explícito no XML).
+VALORES_TEXTO = False
+FORMATO_VALOR = "#,##0.00"
+
+# Exportações colunares gravadas junto com o Excel, na mesma passada:
+# "csv" (Relatorio_NFSe.csv) e/ou "parquet" (Relatorio_NFSe_parquet/,
+# particionado competencia=AAAA-MM/tipo=...; requer pyarrow). Na GUI são
+# as opções "Exportar também" (iniciadas daqui); na CLI, relatorio --exportar.
+EXPORTAR     = ()
+PARQUET_LOTE = 10_000
+
+# Abas "Resumo ..." (pandas groupby) ao final do Excel
+RESUMOS = True
+
+# Coleta paralela: BROWSER_WORKERS navegadores, período fatiado por FATIA
+# ("mes", "semana" ou None = só por tipo). 1 = fluxo sequencial de sempre.
+BROWSER_WORKERS = 1
+FATIA           = "mes"
+
+URL_PORTAL = "https://www.nfse.gov.br/EmissorNacional/"
+
+# Links diretos (sem popover) montados a partir da chave de acesso da linha
+FAST_LINKS = True
+URL_XML    = URL_PORTAL + "Notas/Download/NFSe/"
+URL_PDF    = URL_PORTAL + "Notas/Download/DANFSe/"
 
 RE_DATE = re.compile(r"^\d{2}/\d{2}/\d{4}$")
 RE_ISO  = re.compile(r"(\d{4})-(\d{2})")
 RE_BR   = re.compile(r"(\d{2})/(\d{2})/(\d{4})")
+# Chave de acesso (50 dígitos, infNFSe/@Id sem o "NFS") no link de download
+RE_CHAVE = re.compile(r"/Download/(?:NFSe|DANFSe)/(?:NFS)?(\d{50})(?!\w)")
 
 # ═══════════════════════════════════════════════════════
 # TABELAS DE DESCRIÇÃO
@@ -115,6 +202,48 @@ COLUNAS = [
     "Situação", "Tipo",
 ]
 
+COLUNAS_VALOR = (
+    "Valor dos Serviços", "Valor Deduções",
+    "Desconto Incondicionado", "Desconto Condicionado",
+    "Base de Cálculo", "Alíquota ISS", "Valor ISS", "ISS Retido",
+    "Base PIS/COFINS", "Alíq PIS", "Alíq COFINS", "Valor PIS", "Valor COFINS",
+    "PIS Retido", "COFINS Retido", "IR Retido", "CSLL Retido", "INSS Retido",
+    "Outras Retenções", "Total Retenções", "Valor Líquido",
+)
+
+
+class _Nota(tuple):
+    """
+    Linha extraída de um XML: tupla na ordem de COLUNAS, sem dict por nota
+    (os nomes das colunas não se repetem em cada linha). Página/Linha abrem
+    e Situação/Tipo fecham COLUNAS — nota[2:-2] é o que vem do XML.
+    """
+
+    __slots__ = ()
+    _idx = {c: i for i, c in enumerate(COLUNAS)}
+
+    @classmethod
+    def de(cls, d):
+        return cls(d.get(c) for c in COLUNAS)
+
+    def get(self, col):
+        return self[self._idx[col]]
+
+    def dict(self):
+        return dict(zip(COLUNAS, self))
+
+
+# Registro de uma nota no log_notas.csv / manifesto
+_Log = namedtuple(
+    "_Log", "PAGINA LINHA NUMERO_NFSE CHAVE XML PDF SITUACAO TIPO",
+    defaults=("",) * 6,
+)
+
+
+def _log_de(e):
+    """_Log de um dict lido do manifesto (campos ausentes ficam vazios)."""
+    return _Log(**{k: e[k] for k in _Log._fields if k in e})
+
 
 # ═══════════════════════════════════════════════════════
 # TEMA
@@ -159,6 +288,21 @@ def configure_logger(enable_file=False, path="automat.log"):
     )
 
 
+_aviso_callback = None  # GUI: (nivel, titulo, msg) → messagebox
+
+
+def avisar(nivel, titulo, msg):
+    """nivel: "info" | "aviso" | "erro". Sem GUI, vai só para o log."""
+    if _aviso_callback:
+        try:
+            _aviso_callback(nivel, titulo, msg)
+            return
+        except Exception:
+            pass
+    fn = {"erro": logging.error, "aviso": logging.warning}.get(nivel, logging.info)
+    fn(f"{titulo}: {msg}")
+
+
 def log_info(msg):
     logging.info(msg)
     if _log_callback:
@@ -179,8 +323,20 @@ def ensure_dirs(base):
 # ═══════════════════════════════════════════════════════
 # NAVEGADOR
 # ═══════════════════════════════════════════════════════
-def start_browser():
+def _apontar_portal(url):
+    """Troca o endereço do portal — ex.: o replay local de bench.portal."""
+    global URL_PORTAL, URL_XML, URL_PDF
+    URL_PORTAL = url.rstrip("/") + "/"
+    URL_XML = URL_PORTAL + "Notas/Download/NFSe/"
+    URL_PDF = URL_PORTAL + "Notas/Download/DANFSe/"
+
+
+def _novo_driver(perfil=None, headless=False):
     opts = Options()
+    if perfil:
+        opts.add_argument(f"--user-data-dir={perfil}")
+    if headless:
+        opts.add_argument("--headless=new")
     opts.add_argument("--start-maximized")
     opts.add_argument("--disable-extensions")
     opts.add_argument("--disable-gpu")
@@ -196,18 +352,38 @@ def start_browser():
     driver = webdriver.Edge(service=Service(), options=opts)
     driver.set_page_load_timeout(30)
     driver.implicitly_wait(0)
-    wait = WebDriverWait(driver, 20)
+    return driver
 
-    try:
-        driver.delete_all_cookies()
-    except Exception:
-        pass
 
-    driver.get("https://www.nfse.gov.br/EmissorNacional/Login")
-    messagebox.showinfo(
-        "Login",
-        "Faça o LOGIN para inicar.\nClique OK quando estiver no Dashboard.",
-    )
+def start_browser(cookies=None, perfil=None, headless=False, espera_login=20,
+                  exigir_login=False):
+    """
+    Abre o Edge no login do portal. Na GUI o usuário loga e confirma no aviso;
+    sem GUI o login vem de `cookies` (lista exportada de get_cookies) ou de um
+    `perfil` do Edge com seleção automática de certificado.
+    """
+    driver = _novo_driver(perfil, headless)
+    wait = WebDriverWait(driver, espera_login)
+
+    if not perfil:
+        try:
+            driver.delete_all_cookies()
+        except Exception:
+            pass
+
+    driver.get(URL_PORTAL + "Login")
+    if cookies:
+        for c in cookies:
+            try:
+                driver.add_cookie(c)
+            except Exception:
+                pass
+        driver.get(URL_PORTAL + "Dashboard")
+    else:
+        avisar(
+            "info", "Login",
+            "Faça o LOGIN para inicar.\nClique OK quando estiver no Dashboard.",
+        )
     try:
         wait.until(
             EC.any_of(
@@ -217,25 +393,91 @@ def start_browser():
                 EC.url_contains("/Dashboard"),
             )
         )
+    except Exception:
+        if exigir_login:
+            driver.quit()
+            raise RuntimeError("Login não concluído")
+    try:
         driver.minimize_window()
     except Exception:
         pass
     log_info("✓ Login realizado")
-    return driver, wait
+    return driver, WebDriverWait(driver, 20)
+
+
+def _clonar_navegador(cookies, headless=False):
+    """Novo Edge já autenticado com os cookies da sessão de login."""
+    driver = _novo_driver(headless=headless)
+    driver.get(URL_PORTAL + "Login")
+    for c in cookies:
+        try:
+            driver.add_cookie(c)
+        except Exception:
+            pass
+    try:
+        driver.minimize_window()
+    except Exception:
+        pass
+    return driver
 
 
 # ═══════════════════════════════════════════════════════
 # HELPERS
 # ═══════════════════════════════════════════════════════
-def _has_action(row):
-    return bool(row.find_elements(By.CSS_SELECTOR, "a.icone-trigger"))
+def _snapshot(driver):
+    """
+    Retrato da tabela num único execute_script: para cada tr devolve
+    {i, num, sit, trig, x, p} — índice, nº da nota (1º td numérico entre os
+    3 primeiros), situação (ícone de cancelada), presença do a.icone-trigger
+    e os links diretos de download (id em /Download/NFSe/ ou chave de 50
+    dígitos na própria linha; nulos quando ausentes).
+    """
+    try:
+        return driver.execute_script(
+            """
+            var ux=arguments[0],up=arguments[1],out=[];
+            document.querySelectorAll('table tbody tr').forEach(function(tr,i){
+                var r={i:i,num:'',sit:'Emitida',x:null,p:null,
+                       trig:!!tr.querySelector('a.icone-trigger')};
+                var tds=tr.querySelectorAll('td');
+                for(var j=0;j<tds.length&&j<3;j++){
+                    var t=(tds[j].innerText||'').trim();
+                    if(/^\\d+$/.test(t)){r.num=t;break;}
+                }
+                tr.querySelectorAll("img[src*='tb-']").forEach(function(im){
+                    if((im.src||'').toLowerCase().indexOf('cancelada')>-1)
+                        r.sit='Cancelada';
+                });
+                if(r.trig){
+                    var h=tr.innerHTML,m,k=null;
+                    m=h.match(/\\/Download\\/NFSe\\/([^"'&<>\\s\\/?]+)/);
+                    if(m) k=m[1];
+                    else if((m=h.match(/\\d{50}/))) k=m[0];
+                    if(k){r.x=ux+k;r.p=up+k;}
+                }
+                out.push(r);
+            });
+            return out;
+            """,
+            URL_XML, URL_PDF,
+        ) or []
+    except Exception:
+        return []
 
 
 def _valid_rows(driver):
-    return [
-        r for r in driver.find_elements(By.CSS_SELECTOR, "table tbody tr")
-        if _has_action(r)
-    ]
+    return [r for r in _snapshot(driver) if r.get("trig")]
+
+
+def _botao(driver, i):
+    try:
+        return driver.execute_script(
+            "var r=document.querySelectorAll('table tbody tr')[arguments[0]];"
+            "return r?r.querySelector('a.icone-trigger'):null;",
+            i,
+        )
+    except Exception:
+        return None
 
 
 def _sem_reg(driver):
@@ -245,6 +487,212 @@ def _sem_reg(driver):
         return True
 
 
+class _Ritmo:
+    """Atraso entre ações: dobra a cada erro do portal, cai pela metade a cada sucesso."""
+
+    def __init__(self):
+        self.atraso = 0.0
+        self._lock = threading.Lock()
+
+    def erro(self):
+        with self._lock:
+            self.atraso = min(RETRY_WAIT, max(RITMO_MIN, self.atraso * 2))
+            return self.atraso
+
+    def ok(self):
+        with self._lock:
+            self.atraso = self.atraso / 2 if self.atraso > RITMO_MIN / 4 else 0.0
+
+    def pausa(self):
+        if self.atraso:
+            time.sleep(self.atraso)
+
+
+_ritmo = _Ritmo()
+
+
+class _Metricas:
+    """
+    Tempos por fase, contadores e duração de cada página da execução.
+    Thread-safe; gravar() gera metricas.json e metricas.csv na pasta base.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.t0 = time.perf_counter()
+            self.login = 0.0
+            self.fases = {}
+            self.cont = {}
+            self.paginas = []
+
+    def iniciar(self):
+        """Marca o fim do login: taxa, ETA e notas_por_s contam daqui."""
+        with self._lock:
+            agora = time.perf_counter()
+            self.login = agora - self.t0
+            self.t0 = agora
+
+    def fase(self, nome, seg):
+        with self._lock:
+            f = self.fases.setdefault(nome, [0, 0.0, 0.0])
+            f[0] += 1
+            f[1] += seg
+            f[2] = max(f[2], seg)
+
+    def contar(self, nome, n=1):
+        with self._lock:
+            self.cont[nome] = self.cont.get(nome, 0) + n
+
+    def pagina(self, tipo, fatia, pg, notas, seg):
+        with self._lock:
+            self.paginas.append({
+                "tipo": tipo, "fatia": fatia, "pagina": pg,
+                "notas": notas, "segundos": round(seg, 3),
+            })
+
+    def taxa(self):
+        """Notas por segundo desde o fim do login."""
+        dt = time.perf_counter() - self.t0
+        return self.cont.get("notas", 0) / dt if dt > 0 else 0.0
+
+    def resumo(self):
+        with self._lock:
+            total = time.perf_counter() - self.t0
+            return {
+                "login_s": round(self.login, 3),
+                "total_s": round(total, 3),
+                "notas_por_s": round(self.cont.get("notas", 0) / total, 2) if total else 0,
+                "fases": {
+                    k: {"n": n, "total_s": round(t, 3), "max_s": round(mx, 3),
+                        "media_s": round(t / n, 4)}
+                    for k, (n, t, mx) in sorted(self.fases.items())
+                },
+                "contadores": dict(sorted(self.cont.items())),
+                "paginas": list(self.paginas),
+            }
+
+    def gravar(self, base):
+        r = self.resumo()
+        with open(os.path.join(base, "metricas.json"), "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(base, "metricas.csv"), "w", newline="",
+                  encoding="utf-8-sig") as f:
+            w = csv.writer(f)
+            w.writerow(["fase", "n", "total_s", "max_s", "media_s"])
+            for k, v in r["fases"].items():
+                w.writerow([k, v["n"], v["total_s"], v["max_s"], v["media_s"]])
+            for k, v in r["contadores"].items():
+                w.writerow([k, v, "", "", ""])
+        return r
+
+
+_metricas = _Metricas()
+
+
+class _Gravador:
+    """
+    Grava o HTML de cada página da tabela e de cada popover aberto em
+    pasta/<tipo>/<fatia>/, para o replay offline de bench.portal.
+    Inativo enquanto pasta for None.
+    """
+
+    def __init__(self):
+        self.pasta = None
+
+    def _salvar(self, tipo, fatia, nome, html):
+        d = os.path.join(self.pasta, tipo, fatia or "todas")
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, nome), "w", encoding="utf-8") as f:
+            f.write(html)
+
+    def pagina(self, driver, tipo, fatia, pg):
+        if self.pasta:
+            try:
+                self._salvar(tipo, fatia, f"p{pg:04d}.html", driver.page_source)
+            except Exception as e:
+                logging.warning(f"Gravação {tipo} p{pg}: {e}")
+
+    def popover(self, tipo, fatia, pg, idx, html):
+        if self.pasta and html:
+            try:
+                self._salvar(tipo, fatia, f"p{pg:04d}_l{idx:03d}.popover.html", html)
+            except OSError as e:
+                logging.warning(f"Gravação {tipo} p{pg} l{idx}: {e}")
+
+
+_gravador = _Gravador()
+
+
+def _medido(fase):
+    """Acumula a duração de cada chamada em _metricas[fase]."""
+    def deco(fn):
+        @wraps(fn)
+        def medir(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _metricas.fase(fase, time.perf_counter() - t)
+        return medir
+    return deco
+
+_MARCA = "data-nfse-old"
+_JS_MARCAR = """
+var m='""" + _MARCA + """',t=document.querySelector('table tbody');
+document.documentElement.setAttribute(m,'1');
+if(t){t.setAttribute(m,'1');if(t.rows[0])t.rows[0].setAttribute(m,'1');}
+"""
+
+
+def _esperar(driver, cond, limite):
+    def _c(d):
+        try:
+            return cond(d)
+        except Exception:
+            return False  # navegação em curso
+    try:
+        WebDriverWait(driver, limite, poll_frequency=0.05).until(_c)
+        return True
+    except _sel_exc.TimeoutException:
+        _metricas.contar("timeouts")
+        return False
+
+
+def _esperar_troca(driver, limite):
+    """Espera a página, o tbody ou a 1ª linha marcados por _JS_MARCAR serem substituídos."""
+    return _esperar(driver, lambda d: d.execute_script(
+        """
+        var m=arguments[0],h=document.documentElement,
+            t=document.querySelector('table tbody'),r=t&&t.rows[0];
+        return document.readyState!=='loading'&&(!h.hasAttribute(m)
+            ||!t||!t.hasAttribute(m)||!r||!r.hasAttribute(m));
+        """,
+        _MARCA,
+    ), limite)
+
+
+def _esperar_tabela(driver, limite):
+    """Espera linhas com ação, aviso de 'sem registros' ou mensagem de erro."""
+    return _esperar(driver, lambda d: d.execute_script(
+        """
+        if(document.querySelector('table tbody tr a.icone-trigger')) return true;
+        var t=((document.body||{}).innerText||'').toLowerCase();
+        return /nenhum registro|sem registros|não foram encontrad|não foi possível|tente novamente|erro ao carregar|serviço indisponível|ocorreu um erro/.test(t);
+        """
+    ), limite)
+
+
+def _recarregar(driver):
+    _metricas.contar("recargas")
+    time.sleep(_ritmo.erro())
+    driver.refresh()
+    _esperar_tabela(driver, PAGE_WAIT)
+
+
 def _erro_pg(driver):
     try:
         t = driver.find_element(By.TAG_NAME, "body").text.lower()
@@ -258,38 +706,36 @@ def _erro_pg(driver):
         return False
 
 
+@_medido("aguardar")
 def _aguardar(driver, wait, tipo):
     for tentativa in range(1, MAX_RETRIES + 1):
-        if _sem_reg(driver):
-            return "SEM"
+        # página de erro também não tem linhas: checar antes de _sem_reg
         if _erro_pg(driver):
             if tentativa < MAX_RETRIES:
-                time.sleep(RETRY_WAIT)
-                driver.refresh()
-                time.sleep(1)
+                _recarregar(driver)
                 continue
             return False
+        if _sem_reg(driver):
+            return "SEM"
         try:
             wait.until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody tr"))
             )
             if _valid_rows(driver):
+                _ritmo.ok()
                 return True
             if _sem_reg(driver):
                 return "SEM"
             if tentativa < MAX_RETRIES:
-                time.sleep(RETRY_WAIT)
-                driver.refresh()
-                time.sleep(1)
+                _recarregar(driver)
                 continue
             return "SEM"
-        except TimeoutException:
+        except _sel_exc.TimeoutException:
+            _metricas.contar("timeouts")
             if _sem_reg(driver):
                 return "SEM"
             if tentativa < MAX_RETRIES:
-                time.sleep(RETRY_WAIT)
-                driver.refresh()
-                time.sleep(1)
+                _recarregar(driver)
             else:
                 return False
     return False
@@ -298,35 +744,59 @@ def _aguardar(driver, wait, tipo):
 # ═══════════════════════════════════════════════════════
 # FILTRO
 # ═══════════════════════════════════════════════════════
-def _filtrar(driver, di, df):
-    driver.execute_script(
-        """
-        var a=document.getElementById('datainicio'),
-            b=document.getElementById('datafim');
-        if(a){a.value=arguments[0];a.dispatchEvent(new Event('change',{bubbles:true}));}
-        if(b){b.value=arguments[1];b.dispatchEvent(new Event('change',{bubbles:true}));}
-        """,
-        di, df,
-    )
-    time.sleep(0.3)
-    ok = driver.execute_script(
-        """
-        var bs=document.querySelectorAll('button');
-        for(var i=0;i<bs.length;i++){
-            var t=bs[i].innerText.trim().toUpperCase();
-            var img=bs[i].querySelector('img[src*="filtrar"]');
-            if(t==='FILTRAR'||img){bs[i].click();return true;}
-        }
-        return false;
-        """
-    )
-    if ok:
-        time.sleep(FILTER_WAIT)
+@_medido("filtrar")
+def _filtrar(driver, di, df, tipo):
+    """
+    Aplica o período e clica em Filtrar. "OK", "SEM" ou False se o portal
+    devolver página de erro em todas as tentativas. A página de erro não tem
+    o formulário: cada nova tentativa reabre Notas/<tipo> antes de refiltrar.
+    """
+    for tentativa in range(1, MAX_RETRIES + 1):
+        if tentativa > 1:
+            _metricas.contar("refiltros")
+            time.sleep(_ritmo.erro())
+            driver.get(URL_PORTAL + "Notas/" + tipo)
+            _esperar(driver, EC.presence_of_element_located(
+                (By.ID, "datainicio")), PAGE_WAIT)
+            if _erro_pg(driver):
+                continue
+        driver.execute_script(
+            """
+            var a=document.getElementById('datainicio'),
+                b=document.getElementById('datafim');
+            if(a){a.value=arguments[0];a.dispatchEvent(new Event('change',{bubbles:true}));}
+            if(b){b.value=arguments[1];b.dispatchEvent(new Event('change',{bubbles:true}));}
+            """,
+            di, df,
+        )
+        _esperar(driver, lambda d: d.execute_script(
+            "var a=document.getElementById('datainicio'),"
+            "b=document.getElementById('datafim');"
+            "return (!a||a.value===arguments[0])&&(!b||b.value===arguments[1]);",
+            di, df,
+        ), 2)
+        ok = driver.execute_script(
+            _JS_MARCAR + """
+            var bs=document.querySelectorAll('button');
+            for(var i=0;i<bs.length;i++){
+                var t=bs[i].innerText.trim().toUpperCase();
+                var img=bs[i].querySelector('img[src*="filtrar"]');
+                if(t==='FILTRAR'||img){bs[i].click();return true;}
+            }
+            return false;
+            """
+        )
+        if not ok:
+            raise RuntimeError("Botão Filtrar não encontrado")
+        _esperar_troca(driver, FILTER_WAIT)
+        _esperar_tabela(driver, FILTER_WAIT)
+        # página de erro também não tem linhas: checar antes de _sem_reg
+        if _erro_pg(driver):
+            continue
         if _sem_reg(driver):
             return "SEM"
-    else:
-        raise RuntimeError("Botão Filtrar não encontrado")
-    return "OK"
+        return "OK"
+    return False
 
 
 # ═══════════════════════════════════════════════════════
@@ -341,12 +811,7 @@ def _criar_sessao(driver):
     )
     s.mount("https://", adapter)
     s.mount("http://", adapter)
-    for c in driver.get_cookies():
-        dom = (c.get("domain") or "").lstrip(".")
-        try:
-            s.cookies.set(c["name"], c["value"], domain=dom)
-        except Exception:
-            s.cookies.set(c["name"], c["value"])
+    _copiar_cookies(driver, s)
     try:
         ua = driver.execute_script("return navigator.userAgent;")
     except Exception:
@@ -355,65 +820,308 @@ def _criar_sessao(driver):
     return s
 
 
-def _baixar(session, url, path):
+def _copiar_cookies(driver, s):
+    for c in driver.get_cookies():
+        dom = (c.get("domain") or "").lstrip(".")
+        try:
+            s.cookies.set(c["name"], c["value"], domain=dom)
+        except Exception:
+            s.cookies.set(c["name"], c["value"])
+
+
+@_medido("download")
+def _baixar(session, url, path, buf=None):
+    """Baixa url em path (via .part). buf: bytearray que recebe uma cópia do corpo."""
+    tmp = path + ".part"
     try:
-        r = session.get(url, timeout=DL_TIMEOUT, stream=True)
-        if r.status_code == 200 and len(r.content) > 100:
-            with open(path, "wb") as f:
-                f.write(r.content)
+        with session.get(url, timeout=DL_TIMEOUT, stream=True) as r:
+            if r.status_code != 200:
+                raise OSError(f"HTTP {r.status_code}")
+            n = 0
+            with open(tmp, "wb") as f:
+                for bloco in r.iter_content(DL_CHUNK):
+                    f.write(bloco)
+                    n += len(bloco)
+                    if buf is not None:
+                        buf += bloco
+            # Content-Length só vale para o corpo sem Content-Encoding
+            cl = r.headers.get("Content-Length", "")
+            if r.headers.get("Content-Encoding") or not cl.isdigit():
+                cl = ""
+        if n > 100 and (not cl or int(cl) == n):
+            os.replace(tmp, path)
+            _metricas.contar("bytes", n)
+            _metricas.contar("downloads_ok")
             return True
     except Exception:
         pass
+    _metricas.contar("downloads_falha")
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
     return False
 
 
-# ═══════════════════════════════════════════════════════
-# SITUAÇÃO + POPUP
-# ═══════════════════════════════════════════════════════
-def _sit(row):
-    try:
-        for img in row.find_elements(By.CSS_SELECTOR, "img[src*='tb-']"):
-            if "cancelada" in (img.get_attribute("src") or "").lower():
-                return "Cancelada"
-    except Exception:
-        pass
-    return "Emitida"
+class FilaDownload:
+    """
+    Pool de downloads único por execução: uma sessão HTTP, DL_WORKERS
+    threads e no máximo `limite` downloads pendentes (back-pressure —
+    enviar() bloqueia o Selenium quando a fila enche). Com `armazem`, os XMLs
+    enviados com extrair=True são extraídos na própria thread do download.
+    """
+
+    def __init__(self, driver, workers=DL_WORKERS, limite=DL_FILA, armazem=None):
+        self.session = _criar_sessao(driver)
+        self.armazem = armazem
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._vagas = threading.BoundedSemaphore(limite)
+        self._lock = threading.Lock()
+        self._destinos = set()
+        self.ok = self.falhas = 0
+
+    def atualizar_cookies(self, driver):
+        try:
+            _copiar_cookies(driver, self.session)
+        except Exception:
+            pass
+
+    def enviar(self, url, path, extrair=False):
+        # mesma nota vista duas vezes (fatias, páginas que deslizam): um
+        # único download por arquivo de destino
+        with self._lock:
+            if path in self._destinos:
+                return None
+            self._destinos.add(path)
+        self._vagas.acquire()
+        try:
+            fut = self._submeter(url, path, extrair)
+        except Exception:
+            self._vagas.release()
+            raise
+        fut.add_done_callback(self._fim)
+        return fut
+
+    def _submeter(self, url, path, extrair):
+        return self._pool.submit(self._tarefa, url, path, extrair)
+
+    def _tarefa(self, url, path, extrair):
+        if not (extrair and self.armazem):
+            return _baixar(self.session, url, path)
+        buf = bytearray()
+        ok = _baixar(self.session, url, path, buf)
+        if ok:
+            try:
+                self.armazem.gravar(path, bytes(buf))
+            except Exception as e:
+                logging.warning(f"Extração antecipada {path}: {e}")
+        return ok
+
+    def _fim(self, fut):
+        self._vagas.release()
+        ok = not fut.cancelled() and fut.exception() is None and fut.result()
+        with self._lock:
+            if ok:
+                self.ok += 1
+            else:
+                self.falhas += 1
+
+    def fechar(self):
+        self._pool.shutdown(wait=True)
+        self.session.close()
+        if self.armazem:
+            self.armazem.fechar()
+        if self.ok or self.falhas:
+            log_info(f"✓ Downloads: {self.ok} ok, {self.falhas} falhas")
+
+
+class FilaDownloadAsync(FilaDownload):
+    """
+    Mesmo contrato da FilaDownload sobre uma aiohttp.ClientSession rodando
+    num event loop em thread própria: um pool de conexões, `concorrencia`
+    downloads simultâneos, no máximo `por_host` requisições/s por host e
+    retentativa com backoff exponencial com jitter. Cookies e User-Agent
+    vêm da sessão de _criar_sessao.
+    """
+
+    def __init__(self, driver, concorrencia=DL_ASYNC, limite=None, armazem=None,
+                 por_host=DL_POR_HOST):
+        import asyncio
+        import aiohttp
+
+        # o ThreadPoolExecutor da base fica ocioso: threads só nascem no submit
+        super().__init__(driver, workers=1, limite=limite or concorrencia * 4,
+                         armazem=armazem)
+        self._aio, self._http = asyncio, aiohttp
+        self._pend = set()
+        self._por_host = por_host
+        self._proximo = {}
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._loop.run_forever, name="dl-async", daemon=True
+        ).start()
+        self._client = self._no_loop(self._abrir(concorrencia))
+
+    def _no_loop(self, coro):
+        return self._aio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _abrir(self, n):
+        self._sem = self._aio.Semaphore(n)
+        self._vez_lock = self._aio.Lock()
+        return self._http.ClientSession(
+            connector=self._http.TCPConnector(limit=n),
+            timeout=self._http.ClientTimeout(
+                sock_connect=DL_TIMEOUT, sock_read=DL_TIMEOUT
+            ),
+            headers={"User-Agent": self.session.headers.get("User-Agent", "")},
+            cookies=self._cookies(),
+        )
 
+    def _cookies(self):
+        return {c.name: c.value for c in self.session.cookies}
 
-def _coletar_links(driver, row, pg, idx, tipo, xdir, pdir):
-    try:
-        btn = row.find_element(By.CSS_SELECTOR, "a.icone-trigger")
-    except (NoSuchElementException, StaleElementReferenceException):
-        return None
+    def atualizar_cookies(self, driver):
+        super().atualizar_cookies(driver)
+        self._loop.call_soon_threadsafe(
+            self._client.cookie_jar.update_cookies, self._cookies()
+        )
+
+    def _submeter(self, url, path, extrair):
+        fut = self._aio.run_coroutine_threadsafe(
+            self._tarefa_async(url, path, extrair), self._loop
+        )
+        with self._lock:
+            self._pend.add(fut)
+        fut.add_done_callback(self._descartar)
+        return fut
+
+    def _descartar(self, fut):
+        # roda na thread do loop; fechar() copia _pend sob o mesmo lock
+        with self._lock:
+            self._pend.discard(fut)
+
+    async def _tarefa_async(self, url, path, extrair):
+        buf = bytearray() if extrair and self.armazem else None
+        async with self._sem:
+            t = time.perf_counter()
+            ok = await self._baixar(url, path, buf)
+            _metricas.fase("download", time.perf_counter() - t)
+        if ok and buf is not None:
+            try:
+                await self._loop.run_in_executor(
+                    None, self.armazem.gravar, path, bytes(buf)
+                )
+            except Exception as e:
+                logging.warning(f"Extração antecipada {path}: {e}")
+        return ok
+
+    async def _vez(self, url):
+        """Espaça as requisições ao mesmo host em 1/por_host segundos."""
+        if not self._por_host:
+            return
+        from urllib.parse import urlsplit
+
+        host = urlsplit(url).hostname
+        async with self._vez_lock:
+            agora = time.monotonic()
+            t = max(agora, self._proximo.get(host, 0.0))
+            self._proximo[host] = t + 1 / self._por_host
+        if t > agora:
+            await self._aio.sleep(t - agora)
+
+    async def _baixar(self, url, path, buf):
+        tmp = path + ".part"
+        for tentativa in range(MAX_RETRIES):
+            if tentativa:
+                await self._aio.sleep(random.uniform(0, RITMO_MIN * 2 ** tentativa))
+            if buf is not None:
+                buf.clear()
+            await self._vez(url)
+            try:
+                async with self._client.get(url) as r:
+                    if r.status != 200:
+                        if r.status == 429 or r.status >= 500:
+                            _metricas.contar("retentativas")
+                            continue
+                        break
+                    n = 0
+                    with open(tmp, "wb") as f:
+                        async for bloco in r.content.iter_chunked(DL_CHUNK):
+                            f.write(bloco)
+                            n += len(bloco)
+                            if buf is not None:
+                                buf += bloco
+                    cl = r.headers.get("Content-Length", "")
+                    if r.headers.get("Content-Encoding") or not cl.isdigit():
+                        cl = ""
+                if n <= 100:
+                    break
+                if not cl or int(cl) == n:
+                    os.replace(tmp, path)
+                    _metricas.contar("bytes", n)
+                    _metricas.contar("downloads_ok")
+                    return True
+            except (self._http.ClientError, self._aio.TimeoutError, OSError):
+                pass
+            _metricas.contar("retentativas")
+        _metricas.contar("downloads_falha")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+    def fechar(self):
+        from concurrent.futures import wait as _esperar_todos
+
+        with self._lock:
+            pend = list(self._pend)
+        _esperar_todos(pend)
+        self._pool.shutdown(wait=False)
+        self._no_loop(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.session.close()
+        if self.armazem:
+            self.armazem.fechar()
+        if self.ok or self.falhas:
+            log_info(f"✓ Downloads (async): {self.ok} ok, {self.falhas} falhas")
+
+
+def _nova_fila(driver, armazem=None, motor=None):
+    """FilaDownload do motor escolhido (DL_MOTOR); sem aiohttp, volta às threads."""
+    motor = DL_MOTOR if motor is None else motor
+    if motor == "async":
+        try:
+            return FilaDownloadAsync(driver, armazem=armazem)
+        except ImportError as e:
+            logging.warning(f"Motor async indisponível ({e.name}); usando threads")
+    return FilaDownload(driver, armazem=armazem)
 
-    sit = _sit(row)
-    num = ""
-    try:
-        for td in row.find_elements(By.TAG_NAME, "td")[:3]:
-            t = td.text.strip()
-            if t.isdigit():
-                num = t
-                break
-    except Exception:
-        pass
 
-    pref = f"{tipo}_p{pg}_l{idx}"
-    xh = ph = None
+# ═══════════════════════════════════════════════════════
+# POPUP
+# ═══════════════════════════════════════════════════════
+def _rapido(row):
+    return FAST_LINKS and bool(row.get("x") and row.get("p"))
 
+
+@_medido("popover")
+def _links_popover(driver, btn):
+    """(link XML, link PDF, outerHTML do popover) — None no que não achar."""
+    xh = ph = html = None
     for tentativa in range(2):
         try:
             if tentativa == 1:
                 driver.execute_script(
                     "arguments[0].scrollIntoView({block:'center'});", btn
                 )
-                time.sleep(0.2)
             driver.execute_script("arguments[0].click();", btn)
             pop = WebDriverWait(driver, POPUP_WAIT).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "div.popover"))
             )
             links = driver.execute_script(
                 """
-                var pop=arguments[0],r={x:null,p:null};
+                var pop=arguments[0],r={x:null,p:null,h:pop.outerHTML};
                 pop.querySelectorAll('a[href]').forEach(function(a){
                     var h=a.href||'';
                     if(h.indexOf('/Download/NFSe/')>-1&&!r.x) r.x=h;
@@ -425,39 +1133,85 @@ def _coletar_links(driver, row, pg, idx, tipo, xdir, pdir):
             )
             xh = links.get("x")
             ph = links.get("p")
+            html = links.get("h")
             break
-        except TimeoutException:
+        except _sel_exc.TimeoutException:
+            _metricas.contar("timeouts")
             if tentativa == 0:
                 continue
         except Exception:
             break
 
-    driver.execute_script(
+    # remove e confirma que nenhum popover sobrou antes da próxima linha
+    _esperar(driver, lambda d: d.execute_script(
         "document.querySelectorAll('.popover').forEach(e=>e.remove());"
-    )
-    time.sleep(CLICK_DELAY)
+        "return !document.querySelector('.popover');"
+    ), POPUP_WAIT)
+    return xh, ph, html
+
+
+def _chave_url(url):
+    m = RE_CHAVE.search(url or "")
+    return m.group(1) if m else ""
+
+
+def _coletar_links(driver, row, pg, idx, tipo, xdir, pdir, feitos=None, fatia=""):
+    """
+    Links da linha e destino dos arquivos. Com chave de acesso no link o
+    arquivo se chama <chave>.xml/.pdf (endereçado pelo conteúdo): uma nota
+    que já está no disco não é baixada de novo, venha de que página vier.
+    Sem chave, cai no nome posicional {tipo}_p{pg}_l{idx}. Notas já feitas
+    (feitos, por _chave_log) só são puladas pela chave vista na própria
+    linha — o nº da NFS-e se repete entre prestadores.
+    """
+    sit = row.get("sit") or "Emitida"
+    num = row.get("num") or ""
+
+    ch_linha = _chave_url(row.get("x")) or _chave_url(row.get("p"))
+    ant = feitos.get(ch_linha) if feitos and ch_linha else None
+    if ant and _nota_ok(ant, xdir, pdir):
+        return {"xh": None, "ph": None, "xp": None, "pp": None, "log": ant}
+
+    if _rapido(row):
+        xh, ph = row["x"], row["p"]
+    else:
+        btn = _botao(driver, row["i"])
+        if btn is None:
+            return None
+        xh, ph, html = _links_popover(driver, btn)
+        _gravador.popover(tipo, fatia, pg, idx, html)
+
+    chave = _chave_url(xh) or _chave_url(ph)
+    if chave:
+        pref = chave
+    else:
+        pref = f"{tipo}_{fatia}_p{pg}_l{idx}" if fatia else f"{tipo}_p{pg}_l{idx}"
+    xp = os.path.join(xdir, f"{pref}.xml") if xh else None
+    pp = os.path.join(pdir, f"{pref}.pdf") if ph else None
 
     return {
-        "xh": xh,
-        "ph": ph,
-        "xp": os.path.join(xdir, f"{pref}.xml") if xh else None,
-        "pp": os.path.join(pdir, f"{pref}.pdf") if ph else None,
-        "log": {
-            "PAGINA": pg, "LINHA": idx, "NUMERO_NFSE": num,
-            "XML": f"{pref}.xml" if xh else "",
-            "PDF": f"{pref}.pdf" if ph else "",
-            "SITUACAO": sit, "TIPO": tipo,
-        },
+        "xh": None if chave and xp and _arquivo_ok(xp) else xh,
+        "ph": None if chave and pp and _arquivo_ok(pp) else ph,
+        "xp": xp,
+        "pp": pp,
+        "log": _Log(
+            PAGINA=pg, LINHA=idx, NUMERO_NFSE=num, CHAVE=chave,
+            XML=f"{pref}.xml" if xh else "",
+            PDF=f"{pref}.pdf" if ph else "",
+            SITUACAO=sit, TIPO=tipo,
+        ),
     }
 
 
 # ═══════════════════════════════════════════════════════
 # PAGINAÇÃO
 # ═══════════════════════════════════════════════════════
+@_medido("paginacao")
 def _next_pg(driver, tipo):
+    _ritmo.pausa()
     try:
         ok = driver.execute_script(
-            """
+            _JS_MARCAR + """
             var sels=[
                 "a[href*='/""" + tipo + """?pg='][title*='Próxima']",
                 "a[data-original-title='Próxima']",
@@ -478,32 +1232,190 @@ def _next_pg(driver, tipo):
             """
         )
         if ok:
-            time.sleep(PAGE_WAIT)
+            _esperar_troca(driver, PAGE_WAIT)
+            _esperar_tabela(driver, PAGE_WAIT)
             return True
     except Exception:
         pass
     return False
 
 
+# ═══════════════════════════════════════════════════════
+# MANIFESTO (RETOMADA)
+# ═══════════════════════════════════════════════════════
+def _arquivo_ok(path):
+    try:
+        return os.path.getsize(path) > 100
+    except OSError:
+        return False
+
+
+def _nota_ok(log, xdir, pdir):
+    return all(
+        not f or _arquivo_ok(os.path.join(d, f))
+        for f, d in ((log.XML, xdir), (log.PDF, pdir))
+    )
+
+
+def _chave_log(log):
+    """Chave de acesso; sem ela, a posição (o nº só é único por prestador)."""
+    return log.CHAVE or f"p{log.PAGINA}_l{log.LINHA}"
+
+
+def _manifesto_ler(path, periodo):
+    """
+    Lê o manifesto append-only de um tipo. Retorna (notas, páginas):
+    notas = {chave: _Log} do período; páginas = concluídas desde o último
+    "fim" (execução completa recomeça da página 1, mas pula notas já baixadas).
+    """
+    notas, paginas = {}, set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    e = json.loads(linha)
+                except ValueError:
+                    continue  # linha truncada por queda
+                if e.pop("periodo", None) != periodo:
+                    continue
+                if "pagina_ok" in e:
+                    paginas.add(e["pagina_ok"])
+                elif e.get("fim"):
+                    paginas.clear()
+                else:
+                    lg = _log_de(e)
+                    notas[_chave_log(lg)] = lg
+    except FileNotFoundError:
+        pass
+    return notas, paginas
+
+
+_manifesto_lock = threading.Lock()
+
+
+def _manifesto_gravar(path, periodo, logs=(), **marca):
+    linhas = [{"periodo": periodo, **lg._asdict()} for lg in logs]
+    if marca:
+        linhas.append({"periodo": periodo, **marca})
+    txt = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in linhas)
+    with _manifesto_lock, open(path, "a+b") as f:
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                txt = "\n" + txt  # isola linha truncada por queda
+        f.write(txt.encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _ordenar_logs(logs):
+    return sorted(logs, key=lambda lg: (lg.PAGINA, lg.LINHA))
+
+
+def _gravar_log_csv(path, logs):
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f)
+        w.writerow(_Log._fields)
+        w.writerows(logs)
+
+
+def _pagina_retomada(notas, paginas, xdir, pdir):
+    """Primeira página não concluída (ou com arquivo faltando/inválido)."""
+    por_pg = {}
+    for lg in notas.values():
+        por_pg.setdefault(lg.PAGINA, []).append(lg)
+    pg = 1
+    while pg in paginas and all(_nota_ok(lg, xdir, pdir) for lg in por_pg.get(pg, ())):
+        pg += 1
+    return pg
+
+
+def _ultima_pg(driver):
+    """Maior ?pg= visível na paginação (0 se não houver)."""
+    try:
+        return int(driver.execute_script(
+            """
+            var m=0;
+            document.querySelectorAll("a[href*='pg=']").forEach(function(a){
+                var r=/[?&]pg=(\\d+)/.exec(a.getAttribute('href')||'');
+                if(r) m=Math.max(m,+r[1]);
+            });
+            return m;
+            """
+        ) or 0)
+    except Exception:
+        return 0
+
+
+def _eta(feitas, estimadas):
+    """Segundos restantes pela vazão da execução; None sem base para estimar."""
+    taxa = _metricas.taxa()
+    if not taxa or estimadas <= feitas:
+        return None
+    return (estimadas - feitas) / taxa
+
+
 # ═══════════════════════════════════════════════════════
 # PROCESSAR TABELA
 # ═══════════════════════════════════════════════════════
-def processar_tabela(driver, wait, tipo, base, di, df, on_progress=None):
+def _progresso(cb):
+    """
+    on_progress(tipo, pg, idx, n_pg, n_total) recebe taxa= e eta= só se
+    aceitar esses nomes (ou **kw); callbacks de 5 argumentos seguem valendo.
+    """
+    if cb is None:
+        return None
+    import inspect
+
+    try:
+        ps = inspect.signature(cb).parameters
+    except (TypeError, ValueError):
+        ps = {}
+    if {"taxa", "eta"} <= ps.keys() or any(
+        p.kind is p.VAR_KEYWORD for p in ps.values()
+    ):
+        return cb
+    return lambda *a, **_: cb(*a)
+
+
+def processar_tabela(driver, wait, tipo, base, di, df, on_progress=None, fila=None,
+                     fatia=""):
+    on_progress = _progresso(on_progress)
     xdir = os.path.join(base, tipo, "XML")
     pdir = os.path.join(base, tipo, "PDF")
     csv_ = os.path.join(base, tipo, "log_notas.csv")
 
-    r = _filtrar(driver, di, df)
+    r = _filtrar(driver, di, df, tipo)
     if r == "SEM":
         log_info(f"⊘ {tipo}: sem registros {di}–{df}")
         return "SEM"
+    if r is False:
+        logging.error(f"{tipo}: portal com erro ao filtrar {di}–{df}")
+        return False
+
+    args = (driver, wait, tipo, xdir, pdir, csv_, f"{di}-{df}", fatia, on_progress)
+    if fila is not None:
+        return _paginar(*args, fila)
+    fila = _nova_fila(driver)
+    try:
+        return _paginar(*args, fila)
+    finally:
+        fila.fechar()
+
+
+def _paginar(driver, wait, tipo, xdir, pdir, csv_, periodo, fatia, on_progress, fila):
+    man = os.path.join(os.path.dirname(csv_), MANIFESTO)
+    feitos, paginas = _manifesto_ler(man, periodo)
+    retomar = _pagina_retomada(feitos, paginas, xdir, pdir)
+    if retomar > 1:
+        log_info(f"↷ {tipo}: retomando na página {retomar}")
 
-    logs = []
     pg = 1
     total = 0
 
     while True:
         log_info(f"━━━ {tipo} página {pg} ━━━")
+        t_pg = time.perf_counter()
         st = _aguardar(driver, wait, tipo)
         if st == "SEM":
             if pg == 1:
@@ -524,48 +1436,155 @@ def processar_tabela(driver, wait, tipo, base, di, df, on_progress=None):
             continue
 
         n = len(linhas)
-        log_info(f"  {n} notas encontradas")
         total += n
-
-        session = _criar_sessao(driver)
-        futures = []
-
-        with ThreadPoolExecutor(max_workers=DL_WORKERS) as pool:
-            for idx, row in enumerate(linhas, 1):
-                time.sleep(CLICK_DELAY)
-                info = _coletar_links(driver, row, pg, idx, tipo, xdir, pdir)
-                if not info:
-                    continue
-                if info["xh"] and info["xp"]:
-                    futures.append(pool.submit(_baixar, session, info["xh"], info["xp"]))
-                if info["ph"] and info["pp"]:
-                    futures.append(pool.submit(_baixar, session, info["ph"], info["pp"]))
-                logs.append(info["log"])
-                if on_progress:
-                    on_progress(tipo, pg, idx, n, total)
-
-            for f in as_completed(futures):
-                try:
-                    f.result(timeout=30)
-                except Exception:
-                    pass
-
-        session.close()
+        _gravador.pagina(driver, tipo, fatia, pg)
+        if pg < retomar:
+            log_info(f"  {n} notas — página já concluída")
+            if not _next_pg(driver, tipo):
+                break
+            pg += 1
+            continue
+        log_info(f"  {n} notas encontradas")
+        # estimativa: páginas que a paginação já mostra, com n notas cada
+        estimadas = total + n * max(0, _ultima_pg(driver) - pg)
+
+        fila.atualizar_cookies(driver)
+        logs = []
+        for idx, row in enumerate(linhas, 1):
+            if not _rapido(row):
+                _ritmo.pausa()
+            info = _coletar_links(
+                driver, row, pg, idx, tipo, xdir, pdir, feitos, fatia
+            )
+            if not info:
+                continue
+            if info["xh"] and info["xp"]:
+                fila.enviar(info["xh"], info["xp"], extrair=True)
+            if info["ph"] and info["pp"]:
+                fila.enviar(info["ph"], info["pp"])
+            logs.append(info["log"])
+            _metricas.contar("notas")
+            if on_progress:
+                feitas = total - n + idx
+                on_progress(tipo, pg, idx, n, total,
+                            taxa=_metricas.taxa(), eta=_eta(feitas, estimadas))
+
+        _manifesto_gravar(man, periodo, logs, pagina_ok=pg)
+        _metricas.pagina(tipo, fatia, pg, n, time.perf_counter() - t_pg)
+        for lg in logs:
+            feitos[_chave_log(lg)] = lg
 
         if not _next_pg(driver, tipo):
             break
         pg += 1
 
-    if logs:
-        pd.DataFrame(logs).to_csv(csv_, index=False, encoding="utf-8-sig")
+    if feitos:
+        if not fatia:  # fatias são consolidadas por _colher_paralelo
+            _gravar_log_csv(csv_, _ordenar_logs(feitos.values()))
+        _manifesto_gravar(man, periodo, fim=True)
         log_info(f"✓ {tipo}: {total} notas, {pg} pág.")
     return "OK"
 
 
+# ═══════════════════════════════════════════════════════
+# COLETA PARALELA
+# ═══════════════════════════════════════════════════════
+def _fatiar_periodo(di, df, modo=FATIA):
+    """Divide DD/MM/AAAA–DD/MM/AAAA em sub-períodos por "mes" ou "semana"."""
+    a = datetime.strptime(di, "%d/%m/%Y").date()
+    b = datetime.strptime(df, "%d/%m/%Y").date()
+    if modo not in ("mes", "semana"):
+        return [(di, df)]
+    out = []
+    while a <= b:
+        if modo == "semana":
+            fim = a + timedelta(days=6 - a.weekday())
+        else:
+            fim = a.replace(day=28) + timedelta(days=4)
+            fim -= timedelta(days=fim.day)
+        fim = min(fim, b)
+        out.append((a.strftime("%d/%m/%Y"), fim.strftime("%d/%m/%Y")))
+        a = fim + timedelta(days=1)
+    return out
+
+
+def _colher_paralelo(driver, fila, base, tipos, di, df, workers, modo,
+                     on_progress=None, headless=False):
+    """
+    Fatia (tipo × sub-período) e distribui as fatias entre `workers`
+    navegadores — o do login mais clones com os mesmos cookies. Cada fatia
+    tem seu período no manifesto; ao final os manifestos das fatias viram o
+    log_notas.csv de cada tipo. Retorna {tipo: "OK" | "SEM" | "ERRO"} —
+    "ERRO" se qualquer fatia do tipo falhou, mesmo com as demais OK.
+    """
+    fatias = _fatiar_periodo(di, df, modo)
+    jobs = [(t, a, b) for t in tipos for a, b in fatias]
+    workers = max(1, min(workers, len(jobs)))
+    log_info(f"⇉ {len(jobs)} fatias em {workers} navegadores")
+
+    cookies = driver.get_cookies()
+    livres = Queue()
+    livres.put(driver)
+    extras = []
+    try:
+        for _ in range(workers - 1):
+            d = _clonar_navegador(cookies, headless)
+            extras.append(d)
+            livres.put(d)
+
+        def _fatia(tipo, a, b):
+            d = livres.get()
+            try:
+                d.get(URL_PORTAL + "Notas/" + tipo)
+                _esperar(d, EC.presence_of_element_located(
+                    (By.ID, "datainicio")), PAGE_WAIT)
+                tag = datetime.strptime(a, "%d/%m/%Y").strftime("%Y%m%d")
+                return processar_tabela(
+                    d, WebDriverWait(d, 20), tipo, base, a, b,
+                    on_progress, fila, tag,
+                )
+            except Exception as e:
+                logging.error(f"Fatia {tipo} {a}–{b}: {e}")
+                return False
+            finally:
+                livres.put(d)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            st = list(pool.map(lambda j: _fatia(*j), jobs))
+    finally:
+        for d in extras:
+            try:
+                d.quit()
+            except Exception:
+                pass
+
+    res = {}
+    for tipo in tipos:
+        man = os.path.join(base, tipo, MANIFESTO)
+        logs = []
+        for t, a, b in jobs:
+            if t == tipo:
+                logs += _ordenar_logs(_manifesto_ler(man, f"{a}-{b}")[0].values())
+        if logs:
+            _gravar_log_csv(os.path.join(base, tipo, "log_notas.csv"), logs)
+            log_info(f"✓ {tipo}: {len(logs)} notas em {len(fatias)} fatias")
+        rs = [(a, b, r) for (t, a, b), r in zip(jobs, st) if t == tipo]
+        falhas = [f"{a}–{b}" for a, b, r in rs if r is False]
+        if falhas:
+            logging.error(f"{tipo}: {len(falhas)} de {len(rs)} fatias falharam: "
+                          + ", ".join(falhas))
+            res[tipo] = "ERRO"
+        else:
+            res[tipo] = "OK" if any(r == "OK" for *_, r in rs) else "SEM"
+    return res
+
+
 # ═══════════════════════════════════════════════════════
 # HELPERS DE VALOR
 # ═══════════════════════════════════════════════════════
 def _fv(v):
+    if isinstance(v, float):
+        return f"{v:.2f}".replace(".", ",")
     if not v or not str(v).strip():
         return "0"
     try:
@@ -581,6 +1600,19 @@ def _fl(v):
         return 0.0
 
 
+def _num(v):
+    """
+    Valor do XML como float; tag ausente/vazia = None (conta como 0, mas o
+    modo texto a distingue de um 0.00 explícito), texto inválido fica como está.
+    """
+    if not v or not str(v).strip():
+        return None
+    try:
+        return float(str(v).strip())
+    except Exception:
+        return str(v).strip()
+
+
 def _vz(v):
     return str(v).strip() if v and str(v).strip() else "0"
 
@@ -600,37 +1632,232 @@ def _comp(data):
 # ═══════════════════════════════════════════════════════
 # EXTRAÇÃO XML
 # ═══════════════════════════════════════════════════════
-def extrair_xml(path, sit, pg, ln, tipo):
+# Plano de extração: coluna → caminhos candidatos (em ordem de prioridade).
+# Chaves que não são colunas (dCompet, vRetINSS, vRetCP) alimentam cálculos.
+PLANO_XML = {
+    "Nº NFSe":                    ("nNFSe", "Numero", "nDFSe"),
+    "Data Emissão":               ("infDPS/dhEmi", "dhEmi", "DataEmissao", "dhProc"),
+    "dCompet":                    ("infDPS/dCompet", "dCompet"),
+    "CNPJ Prestador":             ("prest/CNPJ", "emit/CNPJ"),
+    "Razão Social Prestador":     ("prest/xNome", "emit/xNome"),
+    "CNPJ Tomador":               ("toma/CNPJ", "tomador/CNPJ"),
+    "CPF Tomador":                ("toma/CPF", "tomador/CPF"),
+    "Razão Social Tomador":       ("toma/xNome", "tomador/xNome"),
+    "Código Tributação Nacional": ("cServ/cTribNac", "cTribNac"),
+    "Descrição Serviço":          ("cServ/xDescServ", "xDescServ", "Discriminacao"),
+    "Local da Prestação":         ("xLocPrestacao", "xLocIncid", "cLocPrestacao"),
+    "Valor dos Serviços":         ("vServPrest/vServ", "vServ"),
+    "Valor Deduções":             ("vDedRed", "vDeducao"),
+    "Desconto Incondicionado":    ("vDescIncond",),
+    "Desconto Condicionado":      ("vDescCond",),
+    "Base de Cálculo":            ("valores/vBC", "vBC"),
+    "Alíquota ISS":               ("valores/pAliqAplic", "pAliqAplic", "BM/pAliq", "tribMun/pAliq"),
+    "Valor ISS":                  ("valores/vISSQN", "vISSQN", "BM/vISS", "vISS"),
+    "tpRetISSQN":                 ("tpRetISSQN", "BM/tpRetISSQN", "tribMun/tpRetISSQN"),
+    "CST PIS/COFINS":             ("piscofins/CST", "CST"),
+    "Base PIS/COFINS":            ("piscofins/vBCPisCofins", "vBCPisCofins"),
+    "Alíq PIS":                   ("piscofins/pAliqPis", "pAliqPis"),
+    "Alíq COFINS":                ("piscofins/pAliqCofins", "pAliqCofins"),
+    "Valor PIS":                  ("piscofins/vPis", "vPis"),
+    "Valor COFINS":               ("piscofins/vCofins", "vCofins"),
+    "tpRetPisCofins":             ("piscofins/tpRetPisCofins", "tpRetPisCofins"),
+    "IR Retido":                  ("tribFed/vRetIRRF", "vRetIRRF"),
+    "CSLL Retido":                ("tribFed/vRetCSLL", "vRetCSLL"),
+    "vRetINSS":                   ("tribFed/vRetINSS", "vRetINSS"),
+    "vRetCP":                     ("tribFed/vRetCP", "vRetCP"),  # FIX V3.1.2: vRetCP (não vRetCPP)
+    "Outras Retenções":           ("vOutrasRet", "OutrasRetencoes"),
+    "Valor Líquido":              ("valores/vLiq", "vLiq", "ValorLiquidoNfse"),
+}
+
+
+def _compilar_plano(plano):
+    """Indexa os caminhos pela última tag: tag → [(id, tags ancestrais)]."""
+    caminhos = []
+    for cands in plano.values():
+        for c in cands:
+            if c not in caminhos:
+                caminhos.append(c)
+    por_tag = {}
+    for i, c in enumerate(caminhos):
+        segs = c.split("/")
+        por_tag.setdefault(segs[-1], []).append((i, segs[:-1]))
+    return caminhos, por_tag
+
+
+_CAMINHOS, _POR_TAG = _compilar_plano(PLANO_XML)
+_TAG_LOCAL = {}  # "{ns}tag" → "tag"
+
+
+def _ler_campos(root):
+    """
+    Uma única passada sobre a árvore, resolvendo todos os caminhos do plano.
+    Para cada caminho guarda o mesmo elemento que root.find(".//caminho")
+    devolveria (ordem do documento), sem mutar tags/atributos.
+    Retorna ({caminho: texto}, chave).
+    """
+    loc, por_tag = _TAG_LOCAL, _POR_TAG
+    melhor = {}
+    chave = None
+    ordem = 0
+    # ancestrais abaixo da raiz — o topo da cadeia nunca é a raiz (".//")
+    anc_tag, anc_ord = [], []
+    pilha = [iter(root)]
+    while pilha:
+        for el in pilha[-1]:
+            tag = el.tag
+            try:
+                tag = loc[tag]
+            except KeyError:
+                loc[tag] = tag = tag.split("}", 1)[1] if "}" in tag else tag
+            if chave is None and tag == "infNFSe":
+                chave = ""
+                for k, v in el.attrib.items():
+                    if k.split("}")[-1] == "Id":
+                        chave = v
+            cands = por_tag.get(tag)
+            if cands:
+                for i, segs in cands:
+                    if not segs:
+                        if i not in melhor:
+                            melhor[i] = ((ordem,), el)
+                        continue
+                    n = len(segs)
+                    if anc_tag[-n:] != segs:
+                        continue
+                    k = (*anc_ord[-n:], ordem)
+                    atual = melhor.get(i)
+                    if atual is None or k < atual[0]:
+                        melhor[i] = (k, el)
+            if len(el):
+                anc_tag.append(tag)
+                anc_ord.append(ordem)
+                pilha.append(iter(el))
+                ordem += 1
+                break
+            ordem += 1
+        else:
+            pilha.pop()
+            if anc_tag:
+                anc_tag.pop()
+                anc_ord.pop()
+
+    campos = {}
+    for i, (_, el) in melhor.items():
+        txt = el.text
+        if txt and txt.strip():
+            campos[_CAMINHOS[i]] = txt.strip()
+    return campos, chave or ""
+
+
+_SEGS = {s for cands in _POR_TAG.values() for _, segs in cands for s in segs}
+# tags do plano, ancestrais dos caminhos e infNFSe, em qualquer namespace
+_FILTRO_LXML = tuple(f"{{*}}{t}" for t in sorted({*_POR_TAG, *_SEGS, "infNFSe"}))
+
+
+def _ler_campos_lxml(root):
+    """
+    _ler_campos sobre uma árvore lxml. O iterador filtrado do lxml (em C)
+    entrega só as tags do plano e os ancestrais dos caminhos, em ordem de
+    documento; a cadeia de ancestrais vem de getparent(). Mesmo resultado
+    de _ler_campos.
+    """
+    loc, por_tag, segs_tags = _TAG_LOCAL, _POR_TAG, _SEGS
+    melhor, ordem_de = {}, {}
+    chave = None
+    for ordem, el in enumerate(root.iterdescendants(*_FILTRO_LXML)):
+        tag = el.tag
+        try:
+            tag = loc[tag]
+        except KeyError:
+            loc[tag] = tag = tag.split("}", 1)[1] if "}" in tag else tag
+        if tag in segs_tags:
+            ordem_de[el] = ordem
+        if chave is None and tag == "infNFSe":
+            chave = ""
+            for k, v in el.attrib.items():
+                if k.split("}")[-1] == "Id":
+                    chave = v
+        for i, segs in por_tag.get(tag, ()):
+            if not segs:
+                if i not in melhor:
+                    melhor[i] = ((ordem,), el)
+                continue
+            k, p = (ordem,), el
+            for s in reversed(segs):
+                p = p.getparent()
+                if p is None or p is root or loc.get(p.tag) != s:
+                    break
+                k = (ordem_de[p], *k)
+            else:
+                atual = melhor.get(i)
+                if atual is None or k < atual[0]:
+                    melhor[i] = (k, el)
+
+    campos = {}
+    for i, (_, el) in melhor.items():
+        txt = el.text
+        if txt and txt.strip():
+            campos[_CAMINHOS[i]] = txt.strip()
+    return campos, chave or ""
+
+
+_xml_local = threading.local()  # um XMLParser do lxml por thread
+
+
+def _motor_xml():
+    """Motor efetivo de XML_MOTOR: "lxml" ou "etree"."""
+    motor = getattr(_xml_local, "motor", None)
+    if motor and motor[0] == XML_MOTOR:
+        return motor[1]
+    efetivo = "etree"
+    if XML_MOTOR in ("auto", "lxml"):
+        try:
+            _xml_local.parser = _lxml.XMLParser(
+                remove_comments=True, remove_pis=True, no_network=True
+            )
+            efetivo = "lxml"
+        except ImportError:
+            if XML_MOTOR == "lxml":
+                logging.warning("lxml não instalado; usando xml.etree")
+    _xml_local.motor = (XML_MOTOR, efetivo)
+    return efetivo
+
+
+def _definir_xml_motor(motor):
+    """initializer do pool de processos: mesmo motor do processo principal."""
+    global XML_MOTOR
+    XML_MOTOR = motor
+
+
+def _ler_xml(path, dados=None):
+    """({caminho: texto}, chave) do XML, pelo motor de XML_MOTOR."""
+    if not dados:
+        with open(path, "rb") as f:  # um read só: mais rápido que parse(path)
+            dados = f.read()
+    if _motor_xml() == "lxml":
+        return _ler_campos_lxml(_lxml.fromstring(dados, _xml_local.parser))
+    return _ler_campos(ET.fromstring(dados))
+
+
+def extrair_xml(path, sit, pg, ln, tipo, dados=None):
+    """dados: conteúdo já em memória (bytes); sem ele o arquivo é lido de path."""
     try:
-        tree = ET.parse(path)
-        root = tree.getroot()
-
-        for el in root.iter():
-            if "}" in el.tag:
-                el.tag = el.tag.split("}", 1)[1]
-            el.attrib = {
-                (k.split("}")[-1] if "}" in k else k): v
-                for k, v in el.attrib.items()
-            }
+        campos, chave = _ler_xml(path, dados)
 
-        def t(*tags):
-            for tg in tags:
-                e = root.find(f".//{tg}")
-                if e is not None and e.text and e.text.strip():
-                    return e.text.strip()
+        def t(col):
+            for c in PLANO_XML[col]:
+                v = campos.get(c)
+                if v:
+                    return v
             return ""
 
         # ── Identificação ──
-        chave = ""
-        inf = root.find(".//infNFSe")
-        if inf is not None:
-            chave = inf.get("Id", "")
-            if chave.startswith("NFS"):
-                chave = chave[3:]
-
-        num = t("nNFSe", "Numero", "nDFSe")
-        dh  = t("infDPS/dhEmi", "dhEmi", "DataEmissao", "dhProc")
-        dcp = t("infDPS/dCompet", "dCompet")
+        if chave.startswith("NFS"):
+            chave = chave[3:]
+
+        num = t("Nº NFSe")
+        dh  = t("Data Emissão")
+        dcp = t("dCompet")
         if dcp:
             m = RE_ISO.match(dcp)
             comp = f"{m.group(2)}/{m.group(1)}" if m else _comp(dh)
@@ -638,66 +1865,66 @@ def extrair_xml(path, sit, pg, ln, tipo):
             comp = _comp(dh)
 
         # ── Prestador / Tomador ──
-        cp  = t("prest/CNPJ",  "emit/CNPJ")
-        rp  = t("prest/xNome", "emit/xNome")
-        ct  = t("toma/CNPJ",   "tomador/CNPJ")
-        cpt = t("toma/CPF",    "tomador/CPF")
-        rt  = t("toma/xNome",  "tomador/xNome")
+        cp  = t("CNPJ Prestador")
+        rp  = t("Razão Social Prestador")
+        ct  = t("CNPJ Tomador")
+        cpt = t("CPF Tomador")
+        rt  = t("Razão Social Tomador")
 
         # ── Serviço ──
-        ctrib = t("cServ/cTribNac", "cTribNac")
-        desc  = t("cServ/xDescServ", "xDescServ", "Discriminacao")
-        local = t("xLocPrestacao", "xLocIncid", "cLocPrestacao")
+        ctrib = t("Código Tributação Nacional")
+        desc  = t("Descrição Serviço")
+        local = t("Local da Prestação")
 
         # ── Valores ──
-        vs   = t("vServPrest/vServ", "vServ")
-        vded = t("vDedRed", "vDeducao")
-        vdi  = t("vDescIncond")
-        vdc  = t("vDescCond")
-        vbc  = t("valores/vBC", "vBC")
-        aiss = t("valores/pAliqAplic", "pAliqAplic", "BM/pAliq", "tribMun/pAliq")
-        viss = t("valores/vISSQN", "vISSQN", "BM/vISS", "vISS")
+        vs   = _num(t("Valor dos Serviços"))
+        vded = _num(t("Valor Deduções"))
+        vdi  = _num(t("Desconto Incondicionado"))
+        vdc  = _num(t("Desconto Condicionado"))
+        vbc  = _num(t("Base de Cálculo"))
+        aiss = _num(t("Alíquota ISS"))
+        viss = _num(t("Valor ISS"))
 
         # ═══ ISS RETENÇÃO ═══
-        tp_iss   = t("tpRetISSQN", "BM/tpRetISSQN", "tribMun/tpRetISSQN")
+        tp_iss   = t("tpRetISSQN")
         desc_iss = DESC_RET_ISSQN.get(tp_iss, "Não Retido")
-        iss_ret  = viss if tp_iss in ("2", "3") else ""
+        iss_ret  = viss if tp_iss in ("2", "3") else None
 
         # ═══ PIS / COFINS ═══
-        cst_pc   = t("piscofins/CST", "CST")
+        cst_pc   = t("CST PIS/COFINS")
         desc_cst = DESC_CST_PISCOFINS.get(cst_pc, "")
-        bpc      = t("piscofins/vBCPisCofins", "vBCPisCofins")
-        ap       = t("piscofins/pAliqPis",     "pAliqPis")
-        ac       = t("piscofins/pAliqCofins",   "pAliqCofins")
-        vpis     = t("piscofins/vPis",   "vPis")
-        vcof     = t("piscofins/vCofins", "vCofins")
-        tp_pc    = t("piscofins/tpRetPisCofins", "tpRetPisCofins")
+        bpc      = _num(t("Base PIS/COFINS"))
+        ap       = _num(t("Alíq PIS"))
+        ac       = _num(t("Alíq COFINS"))
+        vpis     = _num(t("Valor PIS"))
+        vcof     = _num(t("Valor COFINS"))
+        tp_pc    = t("tpRetPisCofins")
         desc_pc  = DESC_RET_PISCOFINS.get(tp_pc, "Não Retido")
 
-        pis_ret = vpis if tp_pc == "1" else ""
-        cof_ret = vcof if tp_pc == "1" else ""
+        pis_ret = vpis if tp_pc == "1" else None
+        cof_ret = vcof if tp_pc == "1" else None
 
         # ═══════════════════════════════════════════════
         # DEMAIS RETENÇÕES — CP + INSS = coluna INSS
-        # FIX V3.1.2: tag correta é vRetCP (não vRetCPP)
         # ═══════════════════════════════════════════════
-        ir   = t("tribFed/vRetIRRF", "vRetIRRF")
-        csll = t("tribFed/vRetCSLL", "vRetCSLL")
+        ir   = _num(t("IR Retido"))
+        csll = _num(t("CSLL Retido"))
 
-        v_inss = _fl(t("tribFed/vRetINSS", "vRetINSS"))
-        v_cp   = _fl(t("tribFed/vRetCP",   "vRetCP"))   # ← CORRIGIDO
+        v_inss = _fl(t("vRetINSS"))
+        v_cp   = _fl(t("vRetCP"))
         inss_total = v_inss + v_cp
-        inss_ret = str(inss_total) if inss_total > 0 else ""
+        inss_ret = inss_total if inss_total > 0 else None
 
-        outr = t("vOutrasRet", "OutrasRetencoes")
+        outr = _num(t("Outras Retenções"))
 
-        total_ret = sum(
-            _fl(v) for v in (iss_ret, pis_ret, cof_ret, ir, csll, inss_ret, outr)
-        )
+        total_ret = round(sum(
+            v for v in (iss_ret, pis_ret, cof_ret, ir, csll, inss_ret, outr)
+            if isinstance(v, float)
+        ), 2) or None
 
-        vliq = t("valores/vLiq", "vLiq", "ValorLiquidoNfse")
+        vliq = _num(t("Valor Líquido"))
 
-        return {
+        return _Nota.de({
             "Página": pg, "Linha": ln,
             "Nº NFSe": _vz(num), "Chave": _vz(chave),
             "Competência": comp, "Data Emissão": _vz(dh),
@@ -706,192 +1933,767 @@ def extrair_xml(path, sit, pg, ln, tipo):
             "Razão Social Tomador": _vz(rt),
             "Código Tributação Nacional": _vz(ctrib),
             "Descrição Serviço": _vz(desc), "Local da Prestação": _vz(local),
-            "Valor dos Serviços": _fv(vs), "Valor Deduções": _fv(vded),
-            "Desconto Incondicionado": _fv(vdi), "Desconto Condicionado": _fv(vdc),
-            "Base de Cálculo": _fv(vbc), "Alíquota ISS": _fv(aiss), "Valor ISS": _fv(viss),
+            "Valor dos Serviços": vs, "Valor Deduções": vded,
+            "Desconto Incondicionado": vdi, "Desconto Condicionado": vdc,
+            "Base de Cálculo": vbc, "Alíquota ISS": aiss, "Valor ISS": viss,
             "tpRetISSQN": _vz(tp_iss) or "1", "Desc. Ret. ISSQN": desc_iss,
-            "ISS Retido": _fv(iss_ret),
+            "ISS Retido": iss_ret,
             "CST PIS/COFINS": _vz(cst_pc),
             "Desc. CST PIS/COFINS": desc_cst if desc_cst else "0",
-            "Base PIS/COFINS": _fv(bpc),
-            "Alíq PIS": _fv(ap), "Alíq COFINS": _fv(ac),
-            "Valor PIS": _fv(vpis), "Valor COFINS": _fv(vcof),
+            "Base PIS/COFINS": bpc,
+            "Alíq PIS": ap, "Alíq COFINS": ac,
+            "Valor PIS": vpis, "Valor COFINS": vcof,
             "tpRetPisCofins": _vz(tp_pc) or "2",
             "Desc. Ret. PIS/COFINS": desc_pc,
-            "PIS Retido": _fv(pis_ret), "COFINS Retido": _fv(cof_ret),
-            "IR Retido": _fv(ir), "CSLL Retido": _fv(csll),
-            "INSS Retido": _fv(inss_ret),
-            "Outras Retenções": _fv(outr),
-            "Total Retenções": _fv(str(total_ret)) if total_ret else "0",
-            "Valor Líquido": _fv(vliq),
+            "PIS Retido": pis_ret, "COFINS Retido": cof_ret,
+            "IR Retido": ir, "CSLL Retido": csll,
+            "INSS Retido": inss_ret,
+            "Outras Retenções": outr,
+            "Total Retenções": total_ret,
+            "Valor Líquido": vliq,
             "Situação": sit, "Tipo": tipo,
-        }
+        })
     except Exception as e:
         logging.error(f"XML {path}: {e}")
     return None
 
 
+# ═══════════════════════════════════════════════════════
+# CACHE DO RELATÓRIO
+# ═══════════════════════════════════════════════════════
+# Página, Linha, Situação e Tipo vêm do log: o cache guarda nota[2:-2] em JSON
+
+
+def _cache_abrir(base, **kw):
+    con = sqlite3.connect(os.path.join(base, CACHE_REL), **kw)
+    con.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS notas ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, dados TEXT)"
+    )
+    v = con.execute("SELECT v FROM meta WHERE k='versao'").fetchone()
+    if not v or v[0] != EXTRATOR_VERSAO:
+        con.execute("DELETE FROM notas")
+        con.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('versao', ?)", (EXTRATOR_VERSAO,)
+        )
+        con.commit()
+    return con
+
+
+def limpar_cache(base):
+    try:
+        os.remove(os.path.join(base, CACHE_REL))
+    except FileNotFoundError:
+        pass
+
+
+class _Armazem:
+    """
+    Linhas extraídas durante o download, gravadas no cache do relatório
+    (mesma chave path + size + mtime) — gerar_excel só as reaproveita.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._con = _cache_abrir(base, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.n = 0
+
+    def gravar(self, path, dados):
+        d = extrair_xml(path, "", 0, 0, "", dados)
+        dados = None if d is None else d[2:-2]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        ch = (os.path.relpath(path, self.base), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            self._con.execute(
+                "INSERT OR REPLACE INTO notas VALUES (?, ?, ?, ?)",
+                (*ch, json.dumps(dados, ensure_ascii=False)),
+            )
+            self.n += 1
+            if self.n % REL_CHUNK == 0:
+                self._con.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._con.commit()
+            self._con.close()
+        if self.n:
+            log_info(f"✓ Extraídos durante o download: {self.n} XMLs")
+
+
+def _janelas(it, n):
+    """Listas de até n itens consumidas de it sob demanda."""
+    it = iter(it)
+    while True:
+        lote = list(islice(it, n))
+        if not lote:
+            return
+        yield lote
+
+
+def _extrair_com_cache(con, base, jobs, pool):
+    """
+    Gera as linhas na ordem de jobs, reaproveitando XMLs inalterados
+    (path + size + mtime); só os que faltam vão para o pool. jobs é lido em
+    janelas de REL_LOTE, com uma consulta ao cache por janela.
+    """
+    usados = novos_n = 0
+    for janela in _janelas(jobs, REL_LOTE):
+        chaves = []
+        for fp, *_ in janela:
+            st = os.stat(fp)
+            chaves.append((os.path.relpath(fp, base), st.st_size, st.st_mtime_ns))
+        salvos = {}
+        for i in range(0, len(chaves), 500):  # limite de parâmetros do SQLite
+            sub = [c[0] for c in chaves[i:i + 500]]
+            for p, size, mtime, dados in con.execute(
+                "SELECT path, size, mtime, dados FROM notas WHERE path IN (%s)"
+                % ",".join("?" * len(sub)), sub,
+            ):
+                salvos[p] = (size, mtime, dados)
+        hits = [salvos.get(ch[0], (None,))[:2] == ch[1:] for ch in chaves]
+        falta = [j for j, hit in zip(janela, hits) if not hit]
+        usados += len(janela) - len(falta)
+        novos_n += len(falta)
+
+        novos = pool.extrair(falta)
+        for (fp, sit, pg, ln, tipo), ch, hit in zip(janela, chaves, hits):
+            if hit:
+                d = json.loads(salvos[ch[0]][2])
+                if d is not None:
+                    d = _Nota((pg, ln, *d, sit, tipo))
+            else:
+                d = next(novos)
+                dados = None if d is None else d[2:-2]
+                con.execute(
+                    "INSERT OR REPLACE INTO notas VALUES (?, ?, ?, ?)",
+                    (*ch, json.dumps(dados, ensure_ascii=False)),
+                )
+            yield d
+        con.commit()
+    log_info(f"  cache: {usados} reaproveitados, {novos_n} novos")
+
+
 # ═══════════════════════════════════════════════════════
 # RELATÓRIO EXCEL
 # ═══════════════════════════════════════════════════════
-def gerar_excel(base, mostrar=True):
-    out = os.path.join(base, "Relatorio_NFSe.xlsx")
+def _extrair_lote(jobs):
+    return [extrair_xml(*j) for j in jobs]
+
+
+class _Pool:
+    """
+    extrair_xml em lotes num pool de processos, criado na primeira lista
+    com mais de REL_CHUNK jobs e reaproveitado entre janelas e tipos. O pool
+    tem sempre `workers` processos; cada chamada limita só os lotes em voo.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = REL_WORKERS if workers is None else workers
+        self._ex = None
+
+    def extrair(self, jobs):
+        """Resultados na ordem de jobs; no máximo 2 lotes por worker em voo."""
+        if self.workers <= 1 or len(jobs) <= REL_CHUNK:
+            for j in jobs:
+                yield extrair_xml(*j)
+            return
+        if self._ex is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._ex = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_definir_xml_motor,
+                initargs=(XML_MOTOR,),
+            )
+        # listas curtas (cache quente) não ocupam o pool inteiro
+        n = min(self.workers, -(-len(jobs) // REL_CHUNK))
+        pend = deque()
+        for i in range(0, len(jobs), REL_CHUNK):
+            pend.append(self._ex.submit(_extrair_lote, jobs[i:i + REL_CHUNK]))
+            if len(pend) >= 2 * n:
+                yield from pend.popleft().result()
+        while pend:
+            yield from pend.popleft().result()
+
+    def fechar(self):
+        if self._ex is not None:
+            self._ex.shutdown(cancel_futures=True)
+            self._ex = None
+
+
+def _int(v):
     try:
-        with pd.ExcelWriter(out, engine="openpyxl") as wr:
-            achou = False
-            tr = te = 0
-            for tipo in ("Recebidas", "Emitidas"):
-                xdir = os.path.join(base, tipo, "XML")
-                csv_ = os.path.join(base, tipo, "log_notas.csv")
-                if not os.path.isfile(csv_):
+        return int(v)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _jobs_tipo(base, tipo, chaves=None):
+    """
+    Jobs de extração do log_notas.csv do tipo, lidos sob demanda (None se
+    não houver log). chaves: conjunto de chaves de acesso já incluídas
+    (compartilhado entre tipos) — repetidas saem antes de qualquer parse.
+    """
+    csv_ = os.path.join(base, tipo, "log_notas.csv")
+    if not os.path.isfile(csv_):
+        return None
+    return _ler_jobs(csv_, os.path.join(base, tipo, "XML"), tipo,
+                     set() if chaves is None else chaves)
+
+
+def _ler_jobs(csv_, xdir, tipo, chaves):
+    vistos = set()  # só linhas sem chave (arquivos posicionais antigos)
+    try:
+        with open(csv_, newline="", encoding="utf-8-sig") as f:
+            for r in csv.DictReader(f):
+                xf = (r.get("XML") or "").strip()
+                ch = (r.get("CHAVE") or "").strip()
+                if not xf or (ch in chaves if ch else xf in vistos):
                     continue
-                try:
-                    lg = pd.read_csv(csv_)
-                except Exception:
+                fp = os.path.join(xdir, xf)
+                if not os.path.isfile(fp):
                     continue
-                rows, vistos = [], set()
-                for _, r in lg.iterrows():
-                    xf = str(r.get("XML", "")).strip()
-                    if not xf or pd.isna(r.get("XML")) or xf in vistos:
-                        continue
+                if ch:
+                    chaves.add(ch)
+                else:
                     vistos.add(xf)
-                    fp = os.path.join(xdir, xf)
-                    if not os.path.isfile(fp):
-                        continue
-                    s = str(r.get("SITUACAO", "Emitida"))
-                    if pd.isna(r.get("SITUACAO")):
-                        s = "Emitida"
-                    d = extrair_xml(
-                        fp, s, r.get("PAGINA", 0),
-                        r.get("LINHA", 0), r.get("TIPO", tipo),
-                    )
-                    if d:
-                        rows.append(d)
-                if rows:
-                    df = pd.DataFrame(rows).fillna("0")
-                    cols = [c for c in COLUNAS if c in df.columns]
-                    df = df[cols + [c for c in df.columns if c not in COLUNAS]]
-                    df.to_excel(wr, sheet_name=tipo, index=False)
-                    achou = True
-                    if tipo == "Recebidas":
-                        tr = len(rows)
-                    else:
-                        te = len(rows)
-            if not achou:
-                pd.DataFrame({"Info": ["Nenhum XML"]}).to_excel(
-                    wr, sheet_name="Info", index=False
+                yield (
+                    fp, r.get("SITUACAO") or "Emitida", _int(r.get("PAGINA")),
+                    _int(r.get("LINHA")), r.get("TIPO") or tipo,
                 )
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        logging.error(f"Log {csv_}: {e}")
+
+
+def _cabecalho(ws, nomes):
+    """Cabeçalho no estilo do pandas.to_excel (negrito, bordas, centralizado)."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    fina = Side(style="thin")
+    out = []
+    for n in nomes:
+        c = WriteOnlyCell(ws, value=n)
+        c.font = Font(bold=True)
+        c.border = Border(left=fina, right=fina, top=fina, bottom=fina)
+        c.alignment = Alignment(horizontal="center", vertical="top")
+        out.append(c)
+    return out
+
+
+def _linha(ws, d, texto):
+    """Linha na ordem de COLUNAS; valores numéricos com formato de célula."""
+    from openpyxl.cell import WriteOnlyCell
+
+    out = ["0" if v is None else v for v in d]
+    for i in _IDX_VALOR:
+        v = d[i]
+        if texto:
+            out[i] = _fv(v)
+        elif v is None or isinstance(v, float):
+            c = WriteOnlyCell(ws, value=v or 0.0)
+            c.number_format = FORMATO_VALOR
+            out[i] = c
+    return out
+
+
+_IDX_VALOR = [i for i, c in enumerate(COLUNAS) if c in COLUNAS_VALOR]
+_IDX_COMP  = COLUNAS.index("Competência")
+_IDX_TIPO  = COLUNAS.index("Tipo")
+_TIPOS_COL = [
+    float if c in COLUNAS_VALOR else int if c in ("Página", "Linha") else str
+    for c in COLUNAS
+]
+
+
+def _tipada(d):
+    """
+    Linha com tipos fixos para CSV/Parquet: Página/Linha int, COLUNAS_VALOR
+    float (0.0 se a tag faltou, None se o XML trouxe texto inválido),
+    demais colunas str.
+    """
+    out = []
+    for v, k in zip(d, _TIPOS_COL):
+        if k is float:
+            out.append(0.0 if v is None else v if isinstance(v, float) else None)
+        elif k is int:
+            out.append(v if isinstance(v, int) else None)
+        else:
+            out.append("0" if v is None else str(v))
+    return out
+
+
+class _SaidaCsv:
+    """Relatorio_NFSe.csv — UTF-8, separador vírgula, decimal com ponto."""
+
+    def __init__(self, base):
+        self.path = os.path.join(base, "Relatorio_NFSe.csv")
+        self.tmp = self.path + ".tmp"
+        self.f = open(self.tmp, "w", newline="", encoding="utf-8")
+        self.w = csv.writer(self.f)
+        self.w.writerow(COLUNAS)
+
+    def gravar(self, linha):
+        self.w.writerow(linha)
+
+    def fechar(self):
+        self.f.close()
+        os.replace(self.tmp, self.path)
+        log_info(f"✓ CSV: {self.path}")
+
+    def descartar(self):
+        self.f.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+class _SaidaParquet:
+    """
+    Relatorio_NFSe_parquet/competencia=AAAA-MM/tipo=.../part-0.parquet.
+    Os arquivos mantêm o schema completo de COLUNAS; as chaves de partição
+    (minúsculas, sem acento) não colidem com as colunas ao ler como hive.
+    No máximo PARQUET_LOTE linhas em buffer: passando disso, a partição
+    maior vira um row group.
+    """
+
+    def __init__(self, base):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa, self.pq = pa, pq
+        self.pasta = os.path.join(base, "Relatorio_NFSe_parquet")
+        self.tmp = self.pasta + ".tmp"
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        os.makedirs(self.tmp)
+        self.schema = pa.schema([
+            (c, pa.int64() if c in ("Página", "Linha")
+             else pa.float64() if c in COLUNAS_VALOR else pa.string())
+            for c in COLUNAS
+        ])
+        self.buf, self.wr = {}, {}
+        self.n = 0  # linhas em buffer, somando todas as partições
+
+    def gravar(self, linha):
+        m = re.fullmatch(r"(\d{2})/(\d{4})", linha[_IDX_COMP])
+        k = (f"{m.group(2)}-{m.group(1)}" if m else "0", linha[_IDX_TIPO])
+        self.buf.setdefault(k, []).append(linha)
+        self.n += 1
+        if self.n >= PARQUET_LOTE:
+            self._descarregar(max(self.buf, key=lambda x: len(self.buf[x])))
+
+    def _descarregar(self, k):
+        linhas = self.buf.pop(k, None)
+        if not linhas:
+            return
+        self.n -= len(linhas)
+        cols = zip(*linhas)
+        tb = self.pa.Table.from_arrays(
+            [self.pa.array(c, type=f.type) for c, f in zip(cols, self.schema)],
+            schema=self.schema,
+        )
+        w = self.wr.get(k)
+        if w is None:
+            d = os.path.join(self.tmp, f"competencia={k[0]}", f"tipo={k[1]}")
+            os.makedirs(d, exist_ok=True)
+            w = self.wr[k] = self.pq.ParquetWriter(
+                os.path.join(d, "part-0.parquet"), self.schema
+            )
+        w.write_table(tb)
+
+    def fechar(self):
+        for k in list(self.buf):
+            self._descarregar(k)
+        for w in self.wr.values():
+            w.close()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+        os.replace(self.tmp, self.pasta)
+        log_info(f"✓ Parquet: {self.pasta}")
+
+    def descartar(self):
+        for w in self.wr.values():
+            try:
+                w.close()
+            except Exception:
+                pass
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+_SAIDAS = {"csv": _SaidaCsv, "parquet": _SaidaParquet}
+
+
+# ═══════════════════════════════════════════════════════
+# RESUMOS
+# ═══════════════════════════════════════════════════════
+_RETENCOES = (
+    "ISS Retido", "PIS Retido", "COFINS Retido",
+    "IR Retido", "CSLL Retido", "INSS Retido", "Outras Retenções",
+)
+_RES_VALORES = (
+    "Valor dos Serviços", "Valor ISS", *_RETENCOES,
+    "Total Retenções", "Valor Líquido",
+)
+_RES_CHAVES = (
+    "Tipo", "Situação", "Competência",
+    "CNPJ Prestador", "Razão Social Prestador",
+    "CNPJ Tomador", "CPF Tomador", "Razão Social Tomador",
+    "Código Tributação Nacional",
+)
+
+
+_RES_GRUPOS = (
+    ("Resumo Competência", ("Tipo", "_ord", "Competência")),
+    ("Resumo Prestador", ("Tipo", "CNPJ Prestador", "Razão Social Prestador")),
+    ("Resumo Tomador", ("Tipo", "Doc. Tomador", "Razão Social Tomador")),
+    ("Resumo Cód. Tributação", ("Tipo", "Código Tributação Nacional")),
+)
+_RES_RET = ("Tipo", "Retenção", "_ord", "Competência")
+
+
+class _Resumos:
+    """
+    Abas de resumo somadas janela a janela: cada bloco de colunas
+    ({coluna: [valores]}) vira subtotais por grupo, acumulados aos
+    anteriores — a memória cresce com o número de grupos, não de notas.
+    Notas canceladas ficam fora dos totais.
+    """
+
+    def __init__(self):
+        self.parc = {}
+
+    def _juntar(self, nome, p):
+        a = self.parc.get(nome)
+        if a is not None:
+            p = pd.concat([a, p]).groupby(level=list(range(p.index.nlevels)),
+                                          sort=False).sum()
+        self.parc[nome] = p
+
+    def somar(self, col):
+        df = pd.DataFrame(col)
+        df = df[df["Situação"] != "Cancelada"].copy()
+        if df.empty:
+            return
+        vals = list(_RES_VALORES)
+        df[vals] = df[vals].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+        comp = df["Competência"]
+        df["_ord"] = comp.str[-4:] + comp.str[:2]
+        df["Doc. Tomador"] = df["CNPJ Tomador"].where(
+            df["CNPJ Tomador"] != "0", df["CPF Tomador"]
+        )
+        df["Qtde Notas"] = 1
+        for nome, chaves in _RES_GRUPOS:
+            self._juntar(nome, df.groupby(list(chaves), sort=False)[
+                ["Qtde Notas", *vals]].sum())
+
+        ret = df.melt(
+            id_vars=["Tipo", "_ord", "Competência"], value_vars=list(_RETENCOES),
+            var_name="Retenção", value_name="Valor",
+        )
+        ret = ret[ret["Valor"] != 0].assign(**{"Qtde Notas": 1})
+        if not ret.empty:
+            self._juntar("Resumo Retenções", ret.groupby(list(_RES_RET), sort=False)[
+                ["Qtde Notas", "Valor"]].sum())
+
+    def abas(self):
+        """[(nome da aba, DataFrame)] na ordem de sempre."""
+        out = []
+        for nome, _ in _RES_GRUPOS:
+            p = self.parc.get(nome)
+            if p is not None:
+                out.append((nome, p.sort_index().round(2).reset_index()
+                            .drop(columns="_ord", errors="ignore")))
+        p = self.parc.get("Resumo Retenções")
+        if p is not None:
+            r = p.round(2).reset_index().astype(
+                {"Retenção": pd.CategoricalDtype(_RETENCOES, ordered=True)}
+            )
+            out.append(("Resumo Retenções", r.sort_values(list(_RES_RET))
+                        .drop(columns="_ord")[["Tipo", "Retenção", "Competência",
+                                               "Qtde Notas", "Valor"]]))
+        elif out:
+            out.append(("Resumo Retenções", pd.DataFrame(
+                columns=["Tipo", "Retenção", "Competência", "Qtde Notas", "Valor"])))
+        return out
+
+
+def _aba_df(wb, nome, df, texto):
+    from openpyxl.cell import WriteOnlyCell
+
+    ws = wb.create_sheet(nome)
+    ws.append(_cabecalho(ws, list(df.columns)))
+    num = [i for i, c in enumerate(df.columns) if c in _RES_VALORES or c == "Valor"]
+    for tup in df.itertuples(index=False, name=None):
+        row = list(tup)
+        for i in num:
+            if texto:
+                row[i] = _fv(row[i])
+            else:
+                c = WriteOnlyCell(ws, value=float(row[i]))
+                c.number_format = FORMATO_VALOR
+                row[i] = c
+        ws.append(row)
+
+
+def gerar_excel(base, mostrar=True, workers=None, cache=True, texto=None,
+                exportar=None, resumos=None):
+    """
+    Relatório em streaming: o log é lido em janelas de REL_LOTE notas e
+    cada linha extraída vai direto para uma planilha openpyxl write_only —
+    memória limitada pela janela, sem DataFrame intermediário; de cada nota
+    só a chave de acesso fica até o fim (deduplicação).
+    texto=True grava os valores como "1234,56" (padrão: VALORES_TEXTO).
+    exportar: formatos extras de _SAIDAS, na mesma passada (padrão: EXPORTAR).
+    resumos: abas "Resumo ..." ao final (padrão: RESUMOS), somadas por janela.
+    """
+    from openpyxl import Workbook
+
+    texto = VALORES_TEXTO if texto is None else texto
+    exportar = EXPORTAR if exportar is None else exportar
+    resumos = RESUMOS if resumos is None else resumos
+
+    out = os.path.join(base, "Relatorio_NFSe.xlsx")
+    tmp = out + ".tmp"
+    con = None
+    saidas = []
+    pool = _Pool(workers)
+    try:
+        for fmt in exportar:
+            saidas.append(_SAIDAS[fmt](base))
+        if cache:
+            try:
+                con = _cache_abrir(base)
+            except sqlite3.Error as e:
+                logging.warning(f"Cache indisponível: {e}")
+        wb = Workbook(write_only=True)
+        cont = {}
+        # uma linha por chave de acesso: pelo log (antes do parse) e pela
+        # chave lida do XML (arquivos posicionais de execuções antigas)
+        chaves, lidas = set(), set()
+        res = _Resumos() if resumos else None
+        acum = {c: [] for c in _RES_CHAVES + _RES_VALORES}
+        idx_res = [(lst, COLUNAS.index(c)) for c, lst in acum.items()]
+        for tipo in ("Recebidas", "Emitidas"):
+            jobs = _jobs_tipo(base, tipo, chaves)
+            if jobs is None:
+                continue
+            if con is not None:
+                ext = _extrair_com_cache(con, base, jobs, pool)
+            else:
+                ext = (d for j in _janelas(jobs, REL_LOTE) for d in pool.extrair(j))
+            ws = None
+            for d in ext:
+                if not d:
+                    continue
+                ch = d.get("Chave")
+                if ch and ch != "0":
+                    if ch in lidas:
+                        continue
+                    lidas.add(ch)
+                if ws is None:
+                    ws = wb.create_sheet(tipo)
+                    ws.append(_cabecalho(ws, COLUNAS))
+                ws.append(_linha(ws, d, texto))
+                if saidas:
+                    linha = _tipada(d)
+                    for sd in saidas:
+                        sd.gravar(linha)
+                if res is not None:
+                    for lst, i in idx_res:
+                        lst.append(d[i])
+                    if len(acum["Tipo"]) >= REL_LOTE:
+                        res.somar(acum)
+                        for lst, _ in idx_res:
+                            lst.clear()
+                cont[tipo] = cont.get(tipo, 0) + 1
+        if cont and res is not None:
+            if acum["Tipo"]:
+                res.somar(acum)
+            for nome, df in res.abas():
+                _aba_df(wb, nome, df, texto)
+        if not cont:
+            ws = wb.create_sheet("Info")
+            ws.append(_cabecalho(ws, ["Info"]))
+            ws.append(["Nenhum XML"])
+        wb.save(tmp)
+        os.replace(tmp, out)
+        while saidas:
+            saidas.pop(0).fechar()
+        tr = cont.get("Recebidas", 0)
+        te = cont.get("Emitidas", 0)
+
         log_info(f"✓ Relatório: {out}")
         if mostrar:
-            messagebox.showinfo(
-                "Relatório",
+            avisar(
+                "info", "Relatório",
                 f"✓ Gerado!\n\n📥 {tr} recebidas\n📤 {te} emitidas\n\n{out}",
             )
         return out
     except Exception as e:
         logging.error(f"Excel: {e}")
         if mostrar:
-            messagebox.showerror("Erro", str(e))
+            avisar("erro", "Erro", str(e))
         raise
+    finally:
+        pool.fechar()
+        if con is not None:
+            con.close()
+        for sd in saidas:
+            sd.descartar()
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
 
 
 # ═══════════════════════════════════════════════════════
 # ROBÔ PRINCIPAL
 # ═══════════════════════════════════════════════════════
-def run_download(base, di, df, opt, logf, auto_rel, on_progress=None, on_done=None):
+def run_download(base, di, df, opt, logf, auto_rel, on_progress=None, on_done=None,
+                 workers=None, fatia=None, nav=None, motor=None, gravar=None,
+                 exportar=None):
+    """
+    Baixa as notas do período. `nav` são argumentos de start_browser
+    (cookies, perfil, headless...); `motor` é "threads" ou "async" (DL_MOTOR);
+    `gravar` é a pasta onde o HTML das páginas e popovers é guardado para
+    replay offline (bench.portal); `exportar` vai ao relatório automático. Retorna {"rec"/"emi": status, ["erro"]}
+    ou None se os parâmetros forem inválidos.
+    """
     if not base:
-        messagebox.showerror("Erro", "Selecione pasta!")
+        avisar("erro", "Erro", "Selecione pasta!")
         return
     if not di or not df or "AAAA" in di or "AAAA" in df:
-        messagebox.showerror("Erro", "Preencha as datas!")
+        avisar("erro", "Erro", "Preencha as datas!")
         return
     if not RE_DATE.match(di) or not RE_DATE.match(df):
-        messagebox.showerror("Erro", "Use DD/MM/AAAA!")
+        avisar("erro", "Erro", "Use DD/MM/AAAA!")
         return
 
     configure_logger(logf, os.path.join(base, "automat.log"))
     ensure_dirs(base)
+    _metricas.zerar()
+    _gravador.pasta = gravar
 
-    driver = None
+    driver = fila = None
     res = {}
     t0 = time.perf_counter()
     try:
-        driver, wait = start_browser()
-
-        if opt in ("RECEBIDAS", "AMBAS"):
-            log_info("═══ RECEBIDAS ═══")
+        driver, wait = start_browser(**(nav or {}))
+        _metricas.iniciar()
+        armazem = None
+        if auto_rel and PIPELINE_PARSE:
             try:
-                driver.execute_script(
-                    """
-                    var m=document.querySelector("img[src*='menu-recebidas']");
-                    if(m) m.closest('a').click();
-                    else {
-                        var a=document.querySelector("a[href*='Recebidas']");
-                        if(a) a.click();
-                    }
-                    """
-                )
-                time.sleep(1)
+                armazem = _Armazem(base)
+            except sqlite3.Error as e:
+                logging.warning(f"Cache indisponível: {e}")
+        fila = _nova_fila(driver, armazem, motor)
+
+        workers = BROWSER_WORKERS if workers is None else workers
+        if workers > 1:
+            tipos = [
+                t for t, o in (("Recebidas", "RECEBIDAS"), ("Emitidas", "EMITIDAS"))
+                if opt in (o, "AMBAS")
+            ]
+            r = _colher_paralelo(
+                driver, fila, base, tipos, di, df, workers,
+                FATIA if fatia is None else fatia, on_progress,
+                (nav or {}).get("headless", False),
+            )
+            res = {("rec" if t == "Recebidas" else "emi"): v for t, v in r.items()}
+        else:
+            if opt in ("RECEBIDAS", "AMBAS"):
+                log_info("═══ RECEBIDAS ═══")
                 try:
-                    sub = driver.find_element(
-                        By.CSS_SELECTOR, "a[href*='/NFSe/Recebidas']"
+                    driver.execute_script(
+                        """
+                        var m=document.querySelector("img[src*='menu-recebidas']");
+                        if(m) m.closest('a').click();
+                        else {
+                            var a=document.querySelector("a[href*='Recebidas']");
+                            if(a) a.click();
+                        }
+                        """
                     )
-                    driver.execute_script("arguments[0].click();", sub)
+                    _esperar(driver, EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, "a[href*='/NFSe/Recebidas'], #datainicio")
+                    ), PAGE_WAIT)
+                    try:
+                        sub = driver.find_element(
+                            By.CSS_SELECTOR, "a[href*='/NFSe/Recebidas']"
+                        )
+                        driver.execute_script("arguments[0].click();", sub)
+                    except Exception:
+                        pass
                 except Exception:
                     pass
-            except Exception:
-                pass
-            time.sleep(1)
-            res["rec"] = processar_tabela(
-                driver, wait, "Recebidas", base, di, df, on_progress
-            )
+                _esperar(driver, EC.presence_of_element_located(
+                    (By.ID, "datainicio")), PAGE_WAIT)
+                res["rec"] = processar_tabela(
+                    driver, wait, "Recebidas", base, di, df, on_progress, fila
+                )
 
-        if opt in ("EMITIDAS", "AMBAS"):
-            log_info("═══ EMITIDAS ═══")
-            driver.get("https://www.nfse.gov.br/EmissorNacional/Notas/Emitidas")
-            time.sleep(1)
-            res["emi"] = processar_tabela(
-                driver, wait, "Emitidas", base, di, df, on_progress
-            )
+            if opt in ("EMITIDAS", "AMBAS"):
+                log_info("═══ EMITIDAS ═══")
+                driver.get(URL_PORTAL + "Notas/Emitidas")
+                _esperar(driver, EC.presence_of_element_located(
+                    (By.ID, "datainicio")), PAGE_WAIT)
+                res["emi"] = processar_tabela(
+                    driver, wait, "Emitidas", base, di, df, on_progress, fila
+                )
+
+        fila.fechar()
+        fila = None
+        # processar_tabela devolve False em erro: mesmo status das fatias
+        res = {k: "ERRO" if v is False else v for k, v in res.items()}
 
         elapsed = time.perf_counter() - t0
         msg = f"Concluído em {elapsed:.1f}s\n\n"
+        st = {"SEM": "sem registros", "ERRO": "com erros"}
         if opt in ("RECEBIDAS", "AMBAS"):
-            msg += "📥 Recebidas: " + (
-                "sem registros" if res.get("rec") == "SEM" else "OK"
-            ) + "\n"
+            msg += "📥 Recebidas: " + st.get(res.get("rec"), "OK") + "\n"
         if opt in ("EMITIDAS", "AMBAS"):
-            msg += "📤 Emitidas: " + (
-                "sem registros" if res.get("emi") == "SEM" else "OK"
-            ) + "\n"
+            msg += "📤 Emitidas: " + st.get(res.get("emi"), "OK") + "\n"
 
-        if auto_rel and any(v == "OK" for v in res.values()):
+        # "ERRO" pode ser parcial (fatias que falharam): o que veio entra
+        if auto_rel and any(v in ("OK", "ERRO") for v in res.values()):
             try:
-                gerar_excel(base, mostrar=False)
+                gerar_excel(base, mostrar=False, exportar=exportar)
                 msg += "\n📊 Relatório gerado"
             except Exception:
                 pass
         elif auto_rel:
             msg += "\n📊 Sem dados para relatório"
 
-        messagebox.showinfo("Concluído", msg)
+        avisar("info", "Concluído", msg)
 
     except Exception as e:
         logging.error(f"Erro: {e}")
-        messagebox.showerror("Erro", str(e))
+        res["erro"] = str(e)
+        avisar("erro", "Erro", str(e))
     finally:
+        if fila:
+            fila.fechar()
         if driver:
             try:
                 driver.quit()
             except Exception:
                 pass
+        _gravador.pasta = None
+        try:
+            m = _metricas.gravar(base)
+            log_info(f"⏱ {m['notas_por_s']} notas/s — métricas em metricas.json")
+        except OSError as e:
+            logging.warning(f"Métricas: {e}")
         if on_done:
             on_done()
+    return res
 
 
-def run_relatorio(base):
+def run_relatorio(base, exportar=None):
     if not base:
-        messagebox.showerror("Erro", "Selecione pasta!")
+        avisar("erro", "Erro", "Selecione pasta!")
         return
     rx = os.path.join(base, "Recebidas", "XML")
     ex = os.path.join(base, "Emitidas", "XML")
@@ -899,261 +2701,483 @@ def run_relatorio(base):
         (os.path.isdir(rx) and os.listdir(rx))
         or (os.path.isdir(ex) and os.listdir(ex))
     ):
-        messagebox.showwarning("Aviso", "Nenhum XML. Baixe primeiro.")
+        avisar("aviso", "Aviso", "Nenhum XML. Baixe primeiro.")
         return
     configure_logger(True, os.path.join(base, "automat.log"))
-    gerar_excel(base, mostrar=True)
+    return gerar_excel(base, mostrar=True, exportar=exportar)
 
 
 # ═══════════════════════════════════════════════════════
-# INTERFACE MODERNA
+# LINHA DE COMANDO (sem tkinter)
 # ═══════════════════════════════════════════════════════
-class ModernApp(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("NFS-e Portal Nacional")
-        self.geometry("640x780")
-        self.resizable(False, False)
-        self.configure(bg=Theme.BG)
-        self._center()
-        self._build_ui()
-        self._running = False
-
-    def _center(self):
-        self.update_idletasks()
-        w, h = 640, 780
-        x = (self.winfo_screenwidth() - w) // 2
-        y = (self.winfo_screenheight() - h) // 2
-        self.geometry(f"{w}x{h}+{x}+{y}")
-
-    def _card(self, parent, **kw):
-        return tk.Frame(
-            parent, bg=Theme.CARD,
-            highlightbackground=Theme.BORDER,
-            highlightthickness=1, **kw,
-        )
+# Saída: 0 = ok / sem registros, 1 = erro, 2 = parâmetros inválidos
+_TIPOS_CLI = {"recebidas": "RECEBIDAS", "emitidas": "EMITIDAS", "ambas": "AMBAS"}
 
-    def _label(self, parent, text, size=10, bold=False, color=None, **kw):
-        return tk.Label(
-            parent, text=text, bg=parent["bg"],
-            fg=color or Theme.FG,
-            font=(Theme.FONT, size, "bold" if bold else "normal"), **kw,
-        )
 
-    def _entry(self, parent, width=30, placeholder=""):
-        e = tk.Entry(
-            parent, width=width, bg=Theme.ENTRY_BG, fg=Theme.FG,
-            insertbackground=Theme.ACCENT, font=(Theme.FONT, 10),
-            relief="flat", highlightbackground=Theme.ENTRY_BD,
-            highlightcolor=Theme.ACCENT, highlightthickness=1,
-            selectbackground=Theme.ACCENT, selectforeground=Theme.BG,
-        )
-        if placeholder:
-            e.insert(0, placeholder)
-            e.bind("<FocusIn>", lambda ev: e.delete(0, tk.END) if e.get() == placeholder else None)
-            e.bind("<FocusOut>", lambda ev: e.insert(0, placeholder) if not e.get() else None)
-        return e
-
-    def _btn(self, parent, text, command, color=None, fg="white", width=20):
-        bg = color or Theme.BTN_BG
-        b = tk.Button(
-            parent, text=text, command=command,
-            bg=bg, fg=fg, activebackground=bg, activeforeground=fg,
-            font=(Theme.FONT, 10, "bold"), relief="flat",
-            cursor="hand2", width=width, padx=12, pady=8,
-        )
-        hover = {Theme.BTN_BG: Theme.BTN_HOVER, Theme.BTN_BG2: Theme.BTN_HOVER2}.get(bg, Theme.ACCENT)
-        b.bind("<Enter>", lambda e: b.configure(bg=hover))
-        b.bind("<Leave>", lambda e: b.configure(bg=bg))
-        return b
-
-    def _radio(self, parent, text, variable, value):
-        return tk.Radiobutton(
-            parent, text=text, variable=variable, value=value,
-            bg=parent["bg"], fg=Theme.FG, selectcolor=Theme.BG2,
-            activebackground=parent["bg"], activeforeground=Theme.ACCENT,
-            font=(Theme.FONT, 10), cursor="hand2", highlightthickness=0,
-        )
+def _ler_cookies(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-    def _check(self, parent, text, variable):
-        return tk.Checkbutton(
-            parent, text=text, variable=variable,
-            bg=parent["bg"], fg=Theme.FG, selectcolor=Theme.BG2,
-            activebackground=parent["bg"], activeforeground=Theme.ACCENT,
-            font=(Theme.FONT, 9), cursor="hand2", highlightthickness=0,
-        )
 
-    def _build_ui(self):
-        # HEADER
-        header = tk.Frame(self, bg=Theme.BG2, height=70)
-        header.pack(fill=tk.X)
-        header.pack_propagate(False)
-        hi = tk.Frame(header, bg=Theme.BG2)
-        hi.pack(expand=True)
-        tk.Label(hi, text="⚡", bg=Theme.BG2, fg=Theme.ACCENT,
-                 font=(Theme.FONT, 22)).pack(side=tk.LEFT, padx=(0, 8))
-        tk.Label(hi, text="Portal Nacional ", bg=Theme.BG2, fg=Theme.FG,
-                 font=(Theme.FONT, 18, "bold")).pack(side=tk.LEFT)
-        tk.Label(hi, text=" Premier", bg=Theme.BG2, fg=Theme.ACCENT,
-                 font=(Theme.FONT, 10, "bold")).pack(side=tk.LEFT, pady=(6, 0))
-        tk.Frame(self, bg=Theme.ACCENT, height=2).pack(fill=tk.X)
-
-        ct = tk.Frame(self, bg=Theme.BG, padx=24, pady=16)
-        ct.pack(fill=tk.BOTH, expand=True)
-
-        # PASTA
-        c1 = self._card(ct); c1.pack(fill=tk.X, pady=(0, 10))
-        i1 = tk.Frame(c1, bg=Theme.CARD, padx=16, pady=12); i1.pack(fill=tk.X)
-        self._label(i1, "📁  Pasta de destino", 10, True, Theme.ACCENT).pack(anchor=tk.W)
-        rf = tk.Frame(i1, bg=Theme.CARD); rf.pack(fill=tk.X, pady=(8, 0))
-        self.folder_entry = self._entry(rf, 48)
-        self.folder_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        self._btn(rf, "Selecionar", self._sel_folder, Theme.BG3, Theme.ACCENT, 10).pack(side=tk.LEFT, padx=(8, 0))
-
-        # DATAS
-        c2 = self._card(ct); c2.pack(fill=tk.X, pady=(0, 10))
-        i2 = tk.Frame(c2, bg=Theme.CARD, padx=16, pady=12); i2.pack(fill=tk.X)
-        self._label(i2, "📅  Período", 10, True, Theme.ACCENT).pack(anchor=tk.W)
-        rd = tk.Frame(i2, bg=Theme.CARD); rd.pack(fill=tk.X, pady=(8, 0))
-
-        ld = tk.Frame(rd, bg=Theme.CARD); ld.pack(side=tk.LEFT, expand=True, fill=tk.X)
-        self._label(ld, "Início", 9, color=Theme.FG2).pack(anchor=tk.W)
-        self.dt_ini = self._entry(ld, 14, "DD/MM/AAAA")
-        self.dt_ini.pack(anchor=tk.W, pady=(2, 0))
-
-        lf2 = tk.Frame(rd, bg=Theme.CARD); lf2.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(20, 0))
-        self._label(lf2, "Fim", 9, color=Theme.FG2).pack(anchor=tk.W)
-        self.dt_fim = self._entry(lf2, 14, "DD/MM/AAAA")
-        self.dt_fim.pack(anchor=tk.W, pady=(2, 0))
-
-        # CONFIG
-        c3 = self._card(ct); c3.pack(fill=tk.X, pady=(0, 10))
-        i3 = tk.Frame(c3, bg=Theme.CARD, padx=16, pady=12); i3.pack(fill=tk.X)
-        self._label(i3, "📋  Configurações", 10, True, Theme.ACCENT).pack(anchor=tk.W)
-
-        rt = tk.Frame(i3, bg=Theme.CARD); rt.pack(fill=tk.X, pady=(8, 0))
-        self._label(rt, "Tipo:", 9, color=Theme.FG2).pack(side=tk.LEFT, padx=(0, 10))
-        self.opt_var = tk.StringVar(value="AMBAS")
-        self._radio(rt, "📥 Recebidas", self.opt_var, "RECEBIDAS").pack(side=tk.LEFT, padx=(0, 12))
-        self._radio(rt, "📤 Emitidas", self.opt_var, "EMITIDAS").pack(side=tk.LEFT, padx=(0, 12))
-        self._radio(rt, "📦 Ambas", self.opt_var, "AMBAS").pack(side=tk.LEFT)
-
-        ro = tk.Frame(i3, bg=Theme.CARD); ro.pack(fill=tk.X, pady=(8, 0))
-        self.log_var = tk.BooleanVar(value=True)
-        self._check(ro, "💾 Salvar log", self.log_var).pack(side=tk.LEFT, padx=(0, 20))
-        self.auto_var = tk.BooleanVar(value=True)
-        self._check(ro, "📊 Relatório automático", self.auto_var).pack(side=tk.LEFT)
-
-        # BOTÕES
-        rb = tk.Frame(ct, bg=Theme.BG); rb.pack(fill=tk.X, pady=(6, 10))
-        self.btn_dl = self._btn(rb, "▶  BAIXAR ARQUIVOS", self._run, Theme.BTN_BG, "white", 22)
-        self.btn_dl.pack(side=tk.LEFT, padx=(0, 10))
-        self.btn_rp = self._btn(rb, "📊  GERAR RELATÓRIO", self._report, Theme.BTN_BG2, "white", 22)
-        self.btn_rp.pack(side=tk.LEFT)
-
-        # STATUS
-        c4 = self._card(ct); c4.pack(fill=tk.X, pady=(0, 8))
-        i4 = tk.Frame(c4, bg=Theme.CARD, padx=16, pady=10); i4.pack(fill=tk.X)
-        self._label(i4, "⚡  Status", 10, True, Theme.ACCENT).pack(anchor=tk.W)
-        self.progress = ttk.Progressbar(i4, mode="indeterminate", length=400)
-        self.progress.pack(fill=tk.X, pady=(8, 4))
-        self.status_lbl = self._label(i4, "Pronto", 9, color=Theme.FG2)
-        self.status_lbl.pack(anchor=tk.W)
-
-        # LOG
-        c5 = self._card(ct); c5.pack(fill=tk.BOTH, expand=True, pady=(0, 6))
-        i5 = tk.Frame(c5, bg=Theme.CARD, padx=12, pady=8); i5.pack(fill=tk.BOTH, expand=True)
-        self._label(i5, "📜  Log", 9, True, Theme.FG2).pack(anchor=tk.W)
-        self.log_text = tk.Text(
-            i5, height=6, bg=Theme.BG, fg=Theme.GREEN,
-            insertbackground=Theme.GREEN, font=(Theme.FONT_MONO, 8),
-            relief="flat", highlightthickness=0, wrap=tk.WORD,
+def _cli_download(a):
+    nav = {"headless": a.headless, "perfil": a.perfil,
+           "espera_login": a.espera_login, "exigir_login": True}
+    if a.cookies:
+        nav["cookies"] = _ler_cookies(a.cookies)
+    if a.portal:
+        _apontar_portal(a.portal)
+    res = run_download(
+        a.base, a.de, a.ate, _TIPOS_CLI[a.tipo], not a.sem_log, a.relatorio,
+        workers=a.workers, fatia=a.fatia, nav=nav, motor=a.motor, gravar=a.gravar,
+    )
+    if res is None:
+        return 2
+    return 1 if "erro" in res or "ERRO" in res.values() else 0
+
+
+def _formatos(txt):
+    fmts = tuple(f.strip().lower() for f in txt.split(",") if f.strip())
+    ruins = [f for f in fmts if f not in _SAIDAS]
+    if ruins:
+        raise ValueError(", ".join(ruins))
+    return fmts
+
+
+def _cli_relatorio(a):
+    configure_logger(True, os.path.join(a.base, "automat.log"))
+    gerar_excel(
+        a.base, mostrar=False, workers=a.workers, cache=not a.sem_cache,
+        texto=a.valores_texto or None,
+        exportar=a.exportar, resumos=False if a.sem_resumo else None,
+    )
+    return 0
+
+
+def _cli_login(a):
+    driver, _ = start_browser(perfil=a.perfil, espera_login=a.espera_login,
+                              exigir_login=True)
+    try:
+        with open(a.saida, "w", encoding="utf-8") as f:
+            json.dump(driver.get_cookies(), f)
+    finally:
+        driver.quit()
+    log_info(f"✓ Cookies salvos em {a.saida}")
+    return 0
+
+
+def _argv_job(job):
+    """Converte um job do arquivo de lote nos argumentos da CLI."""
+    acao = job.get("acao", "download")
+    argv = [acao, "--base", job["base"]]
+    opcoes = {
+        "download": ("de", "ate", "tipo", "workers", "fatia", "motor", "cookies",
+                     "perfil", "espera-login", "gravar", "portal"),
+        "relatorio": ("workers", "exportar"),
+    }[acao]
+    for k in opcoes:
+        v = job.get(k, job.get(k.replace("-", "_")))
+        if isinstance(v, (list, tuple)):
+            v = ",".join(v)
+        if v not in (None, ""):
+            argv += [f"--{k}", str(v)]
+    flags = {"download": ("relatorio", "headless", "sem-log"),
+             "relatorio": ("sem-cache", "valores-texto", "sem-resumo")}[acao]
+    for k in flags:
+        if job.get(k, job.get(k.replace("-", "_"))):
+            argv.append(f"--{k}")
+    return argv
+
+
+def _rodar_job(i, job):
+    import subprocess
+    cmd = [sys.executable] if getattr(sys, "frozen", False) else [
+        sys.executable, os.path.abspath(__file__)
+    ]
+    t0 = time.perf_counter()
+    try:
+        rc = subprocess.run(cmd + _argv_job(job)).returncode
+    except Exception as e:
+        logging.error(f"Job {i}: {e}")
+        rc = 2
+    return {
+        "job": i, "acao": job.get("acao", "download"), "base": job.get("base"),
+        "de": job.get("de"), "ate": job.get("ate"),
+        "codigo": rc, "segundos": round(time.perf_counter() - t0, 1),
+    }
+
+
+def _cli_lote(a):
+    """
+    Arquivo JSON com uma lista de jobs, ex.:
+    [{"base": "C:/NFSe/12345678000199", "de": "01/01/2025", "ate": "31/01/2025",
+      "tipo": "ambas", "relatorio": true, "cookies": "c.json", "headless": true}]
+    Cada job roda num subprocesso próprio (logs e navegador isolados).
+    """
+    configure_logger(False)
+    with open(a.arquivo, encoding="utf-8") as f:
+        jobs = json.load(f)
+    with ThreadPoolExecutor(max_workers=max(1, a.paralelo)) as pool:
+        res = list(pool.map(lambda ij: _rodar_job(*ij), enumerate(jobs, 1)))
+    for r in res:
+        log_info(
+            f"{'✓' if r['codigo'] == 0 else '✗'} job {r['job']} {r['acao']} "
+            f"{r['base']} → código {r['codigo']} em {r['segundos']}s"
         )
-        self.log_text.pack(fill=tk.BOTH, expand=True, pady=(4, 0))
-        self.log_text.configure(state=tk.DISABLED)
+    if a.saida:
+        with open(a.saida, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+    return max((r["codigo"] for r in res), default=0)
 
-        tk.Label(ct, text="© by Matheus Tecnologia  •  V2.0.1",
-                 bg=Theme.BG, fg=Theme.FG2, font=(Theme.FONT, 8, "italic")).pack(side=tk.BOTTOM)
 
-        global _log_callback
-        _log_callback = self._append_log
+def cli(argv=None):
+    import argparse
+    p = argparse.ArgumentParser(
+        prog="nfse", description="Robô NFS-e (Portal Nacional) sem interface gráfica",
+    )
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    d = sub.add_parser("download", help="baixa XML/PDF do período")
+    d.add_argument("--base", required=True)
+    d.add_argument("--de", "--from", dest="de", required=True, help="DD/MM/AAAA")
+    d.add_argument("--ate", "--to", dest="ate", required=True, help="DD/MM/AAAA")
+    d.add_argument("--tipo", choices=sorted(_TIPOS_CLI), default="ambas")
+    d.add_argument("--relatorio", action="store_true", help="gera o Excel ao final")
+    d.add_argument("--workers", type=int, default=None, help="navegadores em paralelo")
+    d.add_argument("--fatia", choices=("mes", "semana"), default=None)
+    d.add_argument("--motor", choices=("threads", "async"), default=None,
+                   help="motor de download (async requer aiohttp)")
+    d.add_argument("--gravar", help="grava o HTML das páginas para replay offline")
+    d.add_argument("--portal", help="URL base do portal (ex.: replay de bench.portal)")
+    d.add_argument("--cookies", help="JSON de cookies salvo por 'login'")
+    d.add_argument("--perfil", help="pasta de perfil do Edge (--user-data-dir)")
+    d.add_argument("--headless", action="store_true")
+    d.add_argument("--espera-login", type=float, default=120)
+    d.add_argument("--sem-log", action="store_true", help="não grava automat.log")
+    d.set_defaults(fn=_cli_download)
+
+    r = sub.add_parser("relatorio", help="gera Relatorio_NFSe.xlsx")
+    r.add_argument("--base", required=True)
+    r.add_argument("--workers", type=int, default=None, help="processos de extração")
+    r.add_argument("--sem-cache", action="store_true")
+    r.add_argument("--valores-texto", action="store_true",
+                   help='valores como texto "1234,56" (formato antigo)')
+    r.add_argument("--exportar", type=_formatos, default=None,
+                   help="formatos extras, ex.: csv,parquet")
+    r.add_argument("--sem-resumo", action="store_true",
+                   help="não gera as abas de resumo")
+    r.set_defaults(fn=_cli_relatorio)
+
+    lg = sub.add_parser("login", help="login interativo e exporta os cookies")
+    lg.add_argument("--saida", required=True)
+    lg.add_argument("--perfil")
+    lg.add_argument("--espera-login", type=float, default=300)
+    lg.set_defaults(fn=_cli_login)
+
+    lt = sub.add_parser("lote", help="roda vários jobs (empresas/períodos)")
+    lt.add_argument("arquivo", help="JSON com a lista de jobs")
+    lt.add_argument("--paralelo", type=int, default=2)
+    lt.add_argument("--saida", help="grava códigos e tempos por job em JSON")
+    lt.set_defaults(fn=_cli_lote)
+
+    a = p.parse_args(argv)
+    try:
+        return a.fn(a)
+    except Exception as e:
+        logging.error(f"Erro: {e}")
+        return 1
 
-    def _sel_folder(self):
-        d = filedialog.askdirectory()
-        if d:
-            self.folder_entry.delete(0, tk.END)
-            self.folder_entry.insert(0, d)
 
-    def _set_status(self, msg):
-        self.status_lbl.configure(text=msg)
+# ═══════════════════════════════════════════════════════
+# INTERFACE MODERNA
+# ═══════════════════════════════════════════════════════
+tk = ttk = filedialog = messagebox = None  # carregados por _carregar_tk()
+ModernApp = None  # idem: a classe só existe depois do tkinter
+
+
+def _carregar_tk():
+    global tk, ttk, filedialog, messagebox, ModernApp
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+
+    class ModernApp(tk.Tk):
+        """Janela principal — definida em _carregar_tk(), após o import do tkinter."""
+
+        def __init__(self):
+            super().__init__()
+            self.title("NFS-e Portal Nacional")
+            self.geometry("640x780")
+            self.resizable(False, False)
+            self.configure(bg=Theme.BG)
+            self._center()
+            self._build_ui()
+            self._running = False
+
+        def _center(self):
+            self.update_idletasks()
+            w, h = 640, 780
+            x = (self.winfo_screenwidth() - w) // 2
+            y = (self.winfo_screenheight() - h) // 2
+            self.geometry(f"{w}x{h}+{x}+{y}")
+
+        def _card(self, parent, **kw):
+            return tk.Frame(
+                parent, bg=Theme.CARD,
+                highlightbackground=Theme.BORDER,
+                highlightthickness=1, **kw,
+            )
 
-    def _append_log(self, msg):
-        try:
-            self.log_text.configure(state=tk.NORMAL)
-            self.log_text.insert(tk.END, msg + "\n")
-            self.log_text.see(tk.END)
+        def _label(self, parent, text, size=10, bold=False, color=None, **kw):
+            return tk.Label(
+                parent, text=text, bg=parent["bg"],
+                fg=color or Theme.FG,
+                font=(Theme.FONT, size, "bold" if bold else "normal"), **kw,
+            )
+
+        def _entry(self, parent, width=30, placeholder=""):
+            e = tk.Entry(
+                parent, width=width, bg=Theme.ENTRY_BG, fg=Theme.FG,
+                insertbackground=Theme.ACCENT, font=(Theme.FONT, 10),
+                relief="flat", highlightbackground=Theme.ENTRY_BD,
+                highlightcolor=Theme.ACCENT, highlightthickness=1,
+                selectbackground=Theme.ACCENT, selectforeground=Theme.BG,
+            )
+            if placeholder:
+                e.insert(0, placeholder)
+                e.bind("<FocusIn>", lambda ev: e.delete(0, tk.END) if e.get() == placeholder else None)
+                e.bind("<FocusOut>", lambda ev: e.insert(0, placeholder) if not e.get() else None)
+            return e
+
+        def _btn(self, parent, text, command, color=None, fg="white", width=20):
+            bg = color or Theme.BTN_BG
+            b = tk.Button(
+                parent, text=text, command=command,
+                bg=bg, fg=fg, activebackground=bg, activeforeground=fg,
+                font=(Theme.FONT, 10, "bold"), relief="flat",
+                cursor="hand2", width=width, padx=12, pady=8,
+            )
+            hover = {Theme.BTN_BG: Theme.BTN_HOVER, Theme.BTN_BG2: Theme.BTN_HOVER2}.get(bg, Theme.ACCENT)
+            b.bind("<Enter>", lambda e: b.configure(bg=hover))
+            b.bind("<Leave>", lambda e: b.configure(bg=bg))
+            return b
+
+        def _radio(self, parent, text, variable, value):
+            return tk.Radiobutton(
+                parent, text=text, variable=variable, value=value,
+                bg=parent["bg"], fg=Theme.FG, selectcolor=Theme.BG2,
+                activebackground=parent["bg"], activeforeground=Theme.ACCENT,
+                font=(Theme.FONT, 10), cursor="hand2", highlightthickness=0,
+            )
+
+        def _check(self, parent, text, variable):
+            return tk.Checkbutton(
+                parent, text=text, variable=variable,
+                bg=parent["bg"], fg=Theme.FG, selectcolor=Theme.BG2,
+                activebackground=parent["bg"], activeforeground=Theme.ACCENT,
+                font=(Theme.FONT, 9), cursor="hand2", highlightthickness=0,
+            )
+
+        def _build_ui(self):
+            # HEADER
+            header = tk.Frame(self, bg=Theme.BG2, height=70)
+            header.pack(fill=tk.X)
+            header.pack_propagate(False)
+            hi = tk.Frame(header, bg=Theme.BG2)
+            hi.pack(expand=True)
+            tk.Label(hi, text="⚡", bg=Theme.BG2, fg=Theme.ACCENT,
+                     font=(Theme.FONT, 22)).pack(side=tk.LEFT, padx=(0, 8))
+            tk.Label(hi, text="Portal Nacional ", bg=Theme.BG2, fg=Theme.FG,
+                     font=(Theme.FONT, 18, "bold")).pack(side=tk.LEFT)
+            tk.Label(hi, text=" Premier", bg=Theme.BG2, fg=Theme.ACCENT,
+                     font=(Theme.FONT, 10, "bold")).pack(side=tk.LEFT, pady=(6, 0))
+            tk.Frame(self, bg=Theme.ACCENT, height=2).pack(fill=tk.X)
+
+            ct = tk.Frame(self, bg=Theme.BG, padx=24, pady=16)
+            ct.pack(fill=tk.BOTH, expand=True)
+
+            # PASTA
+            c1 = self._card(ct); c1.pack(fill=tk.X, pady=(0, 10))
+            i1 = tk.Frame(c1, bg=Theme.CARD, padx=16, pady=12); i1.pack(fill=tk.X)
+            self._label(i1, "📁  Pasta de destino", 10, True, Theme.ACCENT).pack(anchor=tk.W)
+            rf = tk.Frame(i1, bg=Theme.CARD); rf.pack(fill=tk.X, pady=(8, 0))
+            self.folder_entry = self._entry(rf, 48)
+            self.folder_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            self._btn(rf, "Selecionar", self._sel_folder, Theme.BG3, Theme.ACCENT, 10).pack(side=tk.LEFT, padx=(8, 0))
+
+            # DATAS
+            c2 = self._card(ct); c2.pack(fill=tk.X, pady=(0, 10))
+            i2 = tk.Frame(c2, bg=Theme.CARD, padx=16, pady=12); i2.pack(fill=tk.X)
+            self._label(i2, "📅  Período", 10, True, Theme.ACCENT).pack(anchor=tk.W)
+            rd = tk.Frame(i2, bg=Theme.CARD); rd.pack(fill=tk.X, pady=(8, 0))
+
+            ld = tk.Frame(rd, bg=Theme.CARD); ld.pack(side=tk.LEFT, expand=True, fill=tk.X)
+            self._label(ld, "Início", 9, color=Theme.FG2).pack(anchor=tk.W)
+            self.dt_ini = self._entry(ld, 14, "DD/MM/AAAA")
+            self.dt_ini.pack(anchor=tk.W, pady=(2, 0))
+
+            lf2 = tk.Frame(rd, bg=Theme.CARD); lf2.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(20, 0))
+            self._label(lf2, "Fim", 9, color=Theme.FG2).pack(anchor=tk.W)
+            self.dt_fim = self._entry(lf2, 14, "DD/MM/AAAA")
+            self.dt_fim.pack(anchor=tk.W, pady=(2, 0))
+
+            # CONFIG
+            c3 = self._card(ct); c3.pack(fill=tk.X, pady=(0, 10))
+            i3 = tk.Frame(c3, bg=Theme.CARD, padx=16, pady=12); i3.pack(fill=tk.X)
+            self._label(i3, "📋  Configurações", 10, True, Theme.ACCENT).pack(anchor=tk.W)
+
+            rt = tk.Frame(i3, bg=Theme.CARD); rt.pack(fill=tk.X, pady=(8, 0))
+            self._label(rt, "Tipo:", 9, color=Theme.FG2).pack(side=tk.LEFT, padx=(0, 10))
+            self.opt_var = tk.StringVar(value="AMBAS")
+            self._radio(rt, "📥 Recebidas", self.opt_var, "RECEBIDAS").pack(side=tk.LEFT, padx=(0, 12))
+            self._radio(rt, "📤 Emitidas", self.opt_var, "EMITIDAS").pack(side=tk.LEFT, padx=(0, 12))
+            self._radio(rt, "📦 Ambas", self.opt_var, "AMBAS").pack(side=tk.LEFT)
+
+            ro = tk.Frame(i3, bg=Theme.CARD); ro.pack(fill=tk.X, pady=(8, 0))
+            self.log_var = tk.BooleanVar(value=True)
+            self._check(ro, "💾 Salvar log", self.log_var).pack(side=tk.LEFT, padx=(0, 20))
+            self.auto_var = tk.BooleanVar(value=True)
+            self._check(ro, "📊 Relatório automático", self.auto_var).pack(side=tk.LEFT)
+
+            rx = tk.Frame(i3, bg=Theme.CARD); rx.pack(fill=tk.X, pady=(8, 0))
+            self._label(rx, "Exportar também:", 9, color=Theme.FG2).pack(side=tk.LEFT, padx=(0, 10))
+            self.csv_var = tk.BooleanVar(value="csv" in EXPORTAR)
+            self._check(rx, "CSV", self.csv_var).pack(side=tk.LEFT, padx=(0, 20))
+            self.parquet_var = tk.BooleanVar(value="parquet" in EXPORTAR)
+            self._check(rx, "Parquet", self.parquet_var).pack(side=tk.LEFT)
+
+            # BOTÕES
+            rb = tk.Frame(ct, bg=Theme.BG); rb.pack(fill=tk.X, pady=(6, 10))
+            self.btn_dl = self._btn(rb, "▶  BAIXAR ARQUIVOS", self._run, Theme.BTN_BG, "white", 22)
+            self.btn_dl.pack(side=tk.LEFT, padx=(0, 10))
+            self.btn_rp = self._btn(rb, "📊  GERAR RELATÓRIO", self._report, Theme.BTN_BG2, "white", 22)
+            self.btn_rp.pack(side=tk.LEFT)
+
+            # STATUS
+            c4 = self._card(ct); c4.pack(fill=tk.X, pady=(0, 8))
+            i4 = tk.Frame(c4, bg=Theme.CARD, padx=16, pady=10); i4.pack(fill=tk.X)
+            self._label(i4, "⚡  Status", 10, True, Theme.ACCENT).pack(anchor=tk.W)
+            self.progress = ttk.Progressbar(i4, mode="indeterminate", length=400)
+            self.progress.pack(fill=tk.X, pady=(8, 4))
+            self.status_lbl = self._label(i4, "Pronto", 9, color=Theme.FG2)
+            self.status_lbl.pack(anchor=tk.W)
+
+            # LOG
+            c5 = self._card(ct); c5.pack(fill=tk.BOTH, expand=True, pady=(0, 6))
+            i5 = tk.Frame(c5, bg=Theme.CARD, padx=12, pady=8); i5.pack(fill=tk.BOTH, expand=True)
+            self._label(i5, "📜  Log", 9, True, Theme.FG2).pack(anchor=tk.W)
+            self.log_text = tk.Text(
+                i5, height=6, bg=Theme.BG, fg=Theme.GREEN,
+                insertbackground=Theme.GREEN, font=(Theme.FONT_MONO, 8),
+                relief="flat", highlightthickness=0, wrap=tk.WORD,
+            )
+            self.log_text.pack(fill=tk.BOTH, expand=True, pady=(4, 0))
             self.log_text.configure(state=tk.DISABLED)
-        except Exception:
-            pass
 
-    def _set_running(self, state):
-        self._running = state
-        st = "disabled" if state else "normal"
-        self.btn_dl.configure(state=st)
-        self.btn_rp.configure(state=st)
-        if state:
-            self.progress.start(12)
-        else:
-            self.progress.stop()
+            tk.Label(ct, text="© by Matheus Tecnologia  •  V2.0.1",
+                     bg=Theme.BG, fg=Theme.FG2, font=(Theme.FONT, 8, "italic")).pack(side=tk.BOTTOM)
 
-    def _on_progress(self, tipo, pg, idx, n_pg, n_total):
-        self._set_status(f"{tipo}  •  Pág {pg}  •  Nota {idx}/{n_pg}  •  Total: {n_total}")
+            global _log_callback, _aviso_callback
+            _log_callback = self._append_log
+            _aviso_callback = self._aviso
 
-    def _on_done(self):
-        self._set_running(False)
-        self._set_status("Concluído ✓")
+        def _aviso(self, nivel, titulo, msg):
+            {
+                "erro": messagebox.showerror,
+                "aviso": messagebox.showwarning,
+            }.get(nivel, messagebox.showinfo)(titulo, msg)
 
-    def _run(self):
-        if self._running:
-            return
-        self._set_running(True)
-        self._set_status("Iniciando...")
-        self.log_text.configure(state=tk.NORMAL)
-        self.log_text.delete("1.0", tk.END)
-        self.log_text.configure(state=tk.DISABLED)
-        threading.Thread(
-            target=run_download,
-            args=(
-                self.folder_entry.get().strip(),
-                self.dt_ini.get().strip(),
-                self.dt_fim.get().strip(),
-                self.opt_var.get(),
-                self.log_var.get(),
-                self.auto_var.get(),
-                self._on_progress,
-                self._on_done,
-            ),
-            daemon=True,
-        ).start()
+        def _sel_folder(self):
+            d = filedialog.askdirectory()
+            if d:
+                self.folder_entry.delete(0, tk.END)
+                self.folder_entry.insert(0, d)
 
-    def _report(self):
-        if self._running:
-            return
-        self._set_running(True)
-        self._set_status("Gerando relatório...")
-        threading.Thread(
-            target=lambda: (
-                run_relatorio(self.folder_entry.get().strip()),
-                self._on_done(),
-            ),
-            daemon=True,
-        ).start()
+        def _set_status(self, msg):
+            self.status_lbl.configure(text=msg)
+
+        def _append_log(self, msg):
+            try:
+                self.log_text.configure(state=tk.NORMAL)
+                self.log_text.insert(tk.END, msg + "\n")
+                self.log_text.see(tk.END)
+                self.log_text.configure(state=tk.DISABLED)
+            except Exception:
+                pass
+
+        def _set_running(self, state):
+            self._running = state
+            st = "disabled" if state else "normal"
+            self.btn_dl.configure(state=st)
+            self.btn_rp.configure(state=st)
+            if state:
+                self.progress.start(12)
+            else:
+                self.progress.stop()
+
+        def _on_progress(self, tipo, pg, idx, n_pg, n_total, taxa=0.0, eta=None):
+            txt = f"{tipo}  •  Pág {pg}  •  Nota {idx}/{n_pg}  •  Total: {n_total}"
+            if taxa:
+                txt += f"  •  {taxa:.1f} notas/s"
+            if eta is not None:
+                txt += f"  •  ETA {int(eta) // 60}m{int(eta) % 60:02d}s"
+            self._set_status(txt)
+
+        def _exportar(self):
+            return tuple(
+                f for f, v in (("csv", self.csv_var), ("parquet", self.parquet_var))
+                if v.get()
+            )
+
+        def _on_done(self):
+            self._set_running(False)
+            self._set_status("Concluído ✓")
+
+        def _run(self):
+            if self._running:
+                return
+            self._set_running(True)
+            self._set_status("Iniciando...")
+            self.log_text.configure(state=tk.NORMAL)
+            self.log_text.delete("1.0", tk.END)
+            self.log_text.configure(state=tk.DISABLED)
+            threading.Thread(
+                target=run_download,
+                args=(
+                    self.folder_entry.get().strip(),
+                    self.dt_ini.get().strip(),
+                    self.dt_fim.get().strip(),
+                    self.opt_var.get(),
+                    self.log_var.get(),
+                    self.auto_var.get(),
+                    self._on_progress,
+                    self._on_done,
+                ),
+                kwargs={"exportar": self._exportar()},
+                daemon=True,
+            ).start()
+
+        def _report(self):
+            if self._running:
+                return
+            self._set_running(True)
+            self._set_status("Gerando relatório...")
+            threading.Thread(
+                target=lambda: (
+                    run_relatorio(self.folder_entry.get().strip(), self._exportar()),
+                    self._on_done(),
+                ),
+                daemon=True,
+            ).start()
 
 
 def main():
+    # no executável congelado, os workers do _Pool reexecutam main()
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    _carregar_tk()
     app = ModernApp()
     app.mainloop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
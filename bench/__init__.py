@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks do robô NFS-e sobre um corpus sintético.
+
+    python -m bench --n 2000 --saida bench.json
+
+Mede o import do robô num processo novo (`--so importacao --teto-ms N`
+falha acima do teto ou se pandas, selenium ou tkinter forem carregados),
+extrair_xml (vazão, bytes retidos por nota e paridade dos motores
+lxml e xml.etree — `--so xml` falha se divergirem), gerar_excel (sem e
+com cache; tempo e RSS contra o caminho pandas antigo em `--so
+excel_pandas`; o pico de RSS conforme o corpus cresce — `--teto-mb` falha
+acima do teto) e os downloads (motores threads e async; `--so fila`
+compara uma fila por página com a fila única da execução numa coleta
+simulada) contra um servidor HTTP local; grava vazão, p50/p99 e pico
+de RSS em JSON para comparar versões. `--so portal` roda o robô inteiro em Edge headless contra o
+portal falso de bench.portal; `--so portal_paralelo` compara 1 e
+`--navegadores` navegadores e mede o speedup.
+"""
+
+from .corpus import gerar, nota
+
+__all__ = ["gerar", "nota"]
@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+"""python -m bench — roda os benchmarks e grava os resultados em JSON."""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import EXTRAIR_NFSe_FINAL_OCR as robo  # noqa: E402
+from .corpus import casos_xml, gerar  # noqa: E402
+
+
+def _vmhwm_mb(pid="self"):
+    """VmHWM de /proc/<pid>/status em MB; None fora do Linux ou se o processo sumiu."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for l in f:
+                if l.startswith("VmHWM:"):
+                    return round(int(l.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _rss_pico_mb():
+    """
+    Pico de RSS do processo (monotônico); None se não houver como medir.
+    No Linux vem de VmHWM: ru_maxrss de um processo criado por exec herda
+    o pico do pai e não serve para medir um subprocesso.
+    """
+    v = _vmhwm_mb()
+    if v is not None:
+        return v
+    try:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(kb / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        mi = psutil.Process().memory_info()
+        return round(getattr(mi, "peak_wset", mi.rss) / 2**20, 1)
+    except ImportError:
+        return None
+
+
+def _filhos():
+    pids = []
+    try:
+        for t in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{t}/children") as f:
+                pids += f.read().split()
+    except OSError:
+        pass
+    return pids
+
+
+def _rss_medido(f, *a, **kw):
+    """
+    Roda f e devolve (pico do processo, soma dos picos dos filhos) em MB.
+    Os filhos (workers do _Pool) são amostrados em /proc enquanto f roda.
+    """
+    picos, fim = {}, threading.Event()
+
+    def amostrar():
+        while not fim.wait(0.02):
+            for pid in _filhos():
+                v = _vmhwm_mb(pid)
+                if v:
+                    picos[pid] = max(v, picos.get(pid, 0.0))
+
+    t = threading.Thread(target=amostrar, daemon=True)
+    t.start()
+    try:
+        f(*a, **kw)
+    finally:
+        fim.set()
+        t.join()
+    return _rss_pico_mb(), round(sum(picos.values()), 1)
+
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def _resumo(n, total, lat=None, unidade="notas"):
+    r = {"n": n, "total_s": round(total, 4), f"{unidade}_por_s": round(n / total, 1)}
+    if lat:
+        r["p50_ms"] = round(_pct(lat, 50) * 1e3, 3)
+        r["p99_ms"] = round(_pct(lat, 99) * 1e3, 3)
+    r["rss_pico_mb"] = _rss_pico_mb()
+    return r
+
+
+def bench_extrair(paths):
+    lat = []
+    t0 = time.perf_counter()
+    for p in paths:
+        t = time.perf_counter()
+        robo.extrair_xml(p, "Emitida", 1, 1, "Recebidas")
+        lat.append(time.perf_counter() - t)
+    return _resumo(len(paths), time.perf_counter() - t0, lat)
+
+
+def bench_xml(paths):
+    """
+    Os dois motores de extrair_xml: vazão de cada um e paridade — mesmas
+    linhas para todo o corpus (lido do disco e de bytes) e para os casos
+    de casos_xml(). ok=False se algum resultado divergir.
+    """
+    original = robo.XML_MOTOR
+    casos = casos_xml()
+    res, saidas = {}, {}
+    try:
+        for motor in ("etree", "lxml"):
+            robo.XML_MOTOR = motor
+            if robo._motor_xml() != motor:
+                res[motor] = {"ignorado": "lxml não instalado"}
+                continue
+            t0 = time.perf_counter()
+            arq = [robo.extrair_xml(p, "Emitida", 1, 1, "Recebidas") for p in paths]
+            res[motor] = _resumo(len(paths), time.perf_counter() - t0)
+            mem = []
+            for p in paths:
+                with open(p, "rb") as f:
+                    mem.append(robo.extrair_xml(p, "Emitida", 1, 1, "Recebidas", f.read()))
+            saidas[motor] = (arq, mem, [robo.extrair_xml("", "Emitida", 1, 1, "R", x)
+                                        for _, x in casos])
+    finally:
+        robo.XML_MOTOR = original
+    if len(saidas) == 2:
+        (ea, em, ec), (la, lm, lc) = saidas["etree"], saidas["lxml"]
+        div = [os.path.basename(p) for p, a, b, c, d in zip(paths, ea, la, em, lm)
+               if not a == b == c == d]
+        div += [nome for (nome, _), a, b in zip(casos, ec, lc) if a != b]
+        res["divergencias"] = div[:20]
+        res["ok"] = not div
+        res["ganho_lxml"] = round(
+            res["lxml"]["notas_por_s"] / res["etree"]["notas_por_s"], 2
+        )
+    return res
+
+
+def bench_linhas(base, paths):
+    """
+    Bytes retidos por nota (tracemalloc): linhas de extrair_xml e registros
+    do manifesto lidos por _manifesto_ler, como ficam durante uma execução.
+    """
+    import gc
+    import tracemalloc
+
+    man = os.path.join(base, "bench_manifesto.jsonl")
+    with open(man, "w", encoding="utf-8") as f:
+        for i, p in enumerate(paths):
+            ch = os.path.basename(p)[:-4]
+            f.write(json.dumps({
+                "periodo": "p", "PAGINA": i // 15 + 1, "LINHA": i % 15 + 1,
+                "NUMERO_NFSE": str(i + 1), "CHAVE": ch, "XML": f"{ch}.xml",
+                "PDF": f"{ch}.pdf", "SITUACAO": "Emitida", "TIPO": "Recebidas",
+            }, ensure_ascii=False) + "\n")
+
+    def retido(f):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            x = f()
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0], x
+        finally:
+            tracemalloc.stop()
+
+    b_notas, notas = retido(
+        lambda: [robo.extrair_xml(p, "Emitida", 1, 1, "Recebidas") for p in paths]
+    )
+    b_logs, logs = retido(lambda: robo._manifesto_ler(man, "p")[0])
+    n = len(paths)
+    return {"n": n, "bytes_por_nota": round(b_notas / n), "bytes_por_log": round(b_logs / n),
+            "tipo_nota": type(notas[0]).__name__,
+            "tipo_log": type(next(iter(logs.values()))).__name__}
+
+
+def bench_excel(base, n, workers):
+    out = {}
+    robo.limpar_cache(base)
+    for nome, cache in (("sem_cache", False), ("cache_frio", True), ("cache_quente", True)):
+        t0 = time.perf_counter()
+        robo.gerar_excel(base, mostrar=False, workers=workers, cache=cache)
+        out[nome] = _resumo(n, time.perf_counter() - t0)
+    return out
+
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _medir_filho(func, base, **kw):
+    """
+    Roda func(base, **kw) num processo novo — sem a memória do bench.
+    (segundos, pico de RSS do processo, soma dos picos dos workers) em MB.
+    """
+    import subprocess
+
+    cod = (
+        f"import sys, time; sys.path.insert(0, {_RAIZ!r});"
+        "import EXTRAIR_NFSe_FINAL_OCR as robo;"
+        "import bench.__main__ as b;"
+        "t = time.perf_counter();"
+        f"p, w = b._rss_medido({func}, {base!r}, **{kw!r});"
+        "print(time.perf_counter() - t, p, w)"
+    )
+    out = subprocess.run([sys.executable, "-c", cod], capture_output=True, text=True,
+                         check=True, cwd=_RAIZ).stdout
+    return tuple(float(x) for x in out.split()[-3:])
+
+
+def _rss_relatorio(base, workers, cache):
+    """Pico de RSS (MB) de gerar_excel: (processo do relatório, workers do _Pool)."""
+    return _medir_filho("robo.gerar_excel", base, mostrar=False, workers=workers,
+                        cache=cache)[1:]
+
+
+def _excel_pandas(base, workers=None):
+    """
+    O relatório como era antes do openpyxl write_only, para comparação: log
+    via pandas + iterrows, lista de dicts, DataFrame, fillna e to_excel com
+    o workbook inteiro em memória. A extração é a mesma (_Pool).
+    """
+    import pandas as pd
+
+    pool = robo._Pool(workers)
+    try:
+        with pd.ExcelWriter(os.path.join(base, "Relatorio_pandas.xlsx"),
+                            engine="openpyxl") as xw:
+            for tipo in ("Recebidas", "Emitidas"):
+                csv_ = os.path.join(base, tipo, "log_notas.csv")
+                if not os.path.isfile(csv_):
+                    continue
+                lg = pd.read_csv(csv_, dtype=str, encoding="utf-8-sig").fillna("")
+                jobs = [
+                    (os.path.join(base, tipo, "XML", r["XML"]), r["SITUACAO"] or "Emitida",
+                     int(r["PAGINA"]), int(r["LINHA"]), tipo)
+                    for _, r in lg.iterrows() if r["XML"]
+                ]
+                linhas = [dict(zip(robo.COLUNAS, d)) for d in pool.extrair(jobs)
+                          if d is not None]
+                df = pd.DataFrame(linhas, columns=list(robo.COLUNAS)).fillna("0")
+                df.to_excel(xw, sheet_name=tipo, index=False)
+    finally:
+        pool.fechar()
+
+
+def bench_excel_pandas(base, n, workers):
+    """
+    gerar_excel (write_only, sem cache) contra o caminho pandas antigo, cada
+    um num processo novo: tempo e pico de RSS (processo + workers).
+    """
+    out = {}
+    for nome, func, kw in (
+        ("write_only", "robo.gerar_excel", {"mostrar": False, "cache": False}),
+        ("pandas", "b._excel_pandas", {}),
+    ):
+        s, p, w = _medir_filho(func, base, workers=workers, **kw)
+        out[nome] = {"total_s": round(s, 2), "notas_por_s": round(n / s, 1),
+                     "rss_pico_mb": p, "rss_workers_mb": w,
+                     "rss_total_mb": round(p + w, 1)}
+    a, b = out["write_only"], out["pandas"]
+    out["tempo_pandas_sobre_write_only"] = round(b["total_s"] / a["total_s"], 2)
+    out["rss_pandas_sobre_write_only"] = round(b["rss_total_mb"] / a["rss_total_mb"], 2)
+    return out
+
+
+def bench_memoria(n, semente, workers, teto):
+    """
+    Pico de RSS do relatório com n/4, n/2 e n notas, somando processo e
+    workers: com as janelas de REL_LOTE deve ficar quase plano. ok=False se
+    algum total passar de teto (MB).
+    """
+    ns, rss, wrk = [max(1, n // 4), max(1, n // 2), n], [], []
+    for k in ns:
+        base = tempfile.mkdtemp(prefix="bench_mem_")
+        try:
+            gerar(base, k, semente)
+            p, w = _rss_relatorio(base, workers, False)
+            rss.append(p)
+            wrk.append(w)
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
+    tot = [round(p + w, 1) for p, w in zip(rss, wrk)]
+    r = {"n": ns, "rss_pico_mb": rss, "rss_workers_mb": wrk, "rss_total_mb": tot,
+         "mb_por_mil_notas": round((tot[-1] - tot[0]) / max(1, ns[-1] - ns[0]) * 1e3, 2)}
+    if teto:
+        r["teto_mb"] = teto
+        r["ok"] = max(tot) <= teto
+    return r
+
+
+_PESADOS = ("pandas", "selenium", "tkinter")
+
+
+def bench_importacao(teto, repeticoes=5):
+    """
+    Tempo de `import EXTRAIR_NFSe_FINAL_OCR` num processo novo (mediana de
+    repeticoes). ok=False se pandas/selenium/tkinter forem carregados no
+    import ou se a mediana passar de teto (ms).
+    """
+    import subprocess
+
+    cod = (
+        f"import sys, time, json; sys.path.insert(0, {_RAIZ!r});"
+        "t = time.perf_counter();"
+        "import EXTRAIR_NFSe_FINAL_OCR;"
+        "dt = time.perf_counter() - t;"
+        f"print(json.dumps([dt, [m for m in {_PESADOS!r} if m in sys.modules]]))"
+    )
+    ms, pesados = [], set()
+    for _ in range(repeticoes):
+        out = subprocess.run([sys.executable, "-c", cod], capture_output=True,
+                             text=True, check=True, cwd=_RAIZ).stdout
+        dt, carregados = json.loads(out.splitlines()[-1])
+        ms.append(dt * 1e3)
+        pesados.update(carregados)
+    r = {"ms": round(_pct(ms, 50), 1), "ms_min": round(min(ms), 1),
+         "carregados": sorted(pesados)}
+    if teto:
+        r["teto_ms"] = teto
+    r["ok"] = not pesados and (not teto or r["ms"] <= teto)
+    return r
+
+
+class _SemNavegador:
+    """Só o que _criar_sessao consulta do driver."""
+
+    def get_cookies(self):
+        return []
+
+    def execute_script(self, *_):
+        return "bench"
+
+
+def _servir(raiz, fila, atraso=0.0):
+    """Servidor HTTP/1.1 (keep-alive) dos XMLs, em processo próprio para não
+    disputar o GIL com o cliente medido. atraso: s antes de cada resposta."""
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class H(SimpleHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # senão cabeçalho + corpo esperam o ACK atrasado
+
+        def __init__(self, *a, **kw):
+            super().__init__(*a, directory=raiz, **kw)
+
+        def log_message(self, *_):
+            pass
+
+        def do_GET(self):
+            if atraso:
+                time.sleep(atraso)
+            super().do_GET()
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H)
+    srv.daemon_threads = True
+    fila.put(srv.server_address[1])
+    srv.serve_forever()
+
+
+def bench_baixar(paths, motor, workers):
+    """Download dos XMLs do corpus via fila do motor escolhido ("threads"/"async")."""
+    import multiprocessing as mp
+
+    q = mp.Queue()
+    srv = mp.Process(target=_servir, args=(os.path.dirname(paths[0]), q), daemon=True)
+    srv.start()
+    url = f"http://127.0.0.1:{q.get(timeout=30)}/"
+    dest = tempfile.mkdtemp(prefix="bench_dl_")
+    antes = threading.active_count()
+    if motor == "async":
+        fila = robo.FilaDownloadAsync(_SemNavegador(), concorrencia=workers)
+    else:
+        fila = robo.FilaDownload(_SemNavegador(), workers=workers)
+    lat, threads = [], 0
+
+    def medir(t):
+        return lambda _: lat.append(time.perf_counter() - t)
+
+    try:
+        t0 = time.perf_counter()
+        for p in paths:
+            nome = os.path.basename(p)
+            fut = fila.enviar(url + nome, os.path.join(dest, nome))
+            fut.add_done_callback(medir(time.perf_counter()))
+            threads = max(threads, threading.active_count() - antes)
+        fila.fechar()
+        r = _resumo(len(paths), time.perf_counter() - t0, lat, "arquivos")
+        r["falhas"] = fila.falhas
+        r["threads"] = threads
+        r["mb_por_s"] = round(
+            sum(os.path.getsize(p) for p in paths) / 2**20 / r["total_s"], 2
+        )
+        return r
+    finally:
+        srv.terminate()
+        shutil.rmtree(dest, ignore_errors=True)
+
+
+def bench_fila(paths, workers, clique, atraso, por_pagina=25, paginas=8):
+    """
+    Coleta simulada (clique s por linha, downloads com atraso s no servidor):
+    uma FilaDownload por página com join antes de paginar, como era antes,
+    contra a fila única da execução que sobrepõe downloads e cliques.
+    """
+    import multiprocessing as mp
+
+    q = mp.Queue()
+    srv = mp.Process(target=_servir, args=(os.path.dirname(paths[0]), q, atraso),
+                     daemon=True)
+    srv.start()
+    url = f"http://127.0.0.1:{q.get(timeout=30)}/"
+    paths = paths[:por_pagina * paginas]
+    pags = [paths[i:i + por_pagina] for i in range(0, len(paths), por_pagina)]
+    out = {"arquivos": len(paths), "paginas": len(pags), "clique_s": clique,
+           "atraso_s": atraso, "workers": workers}
+    try:
+        for nome in ("por_pagina", "global"):
+            dest = tempfile.mkdtemp(prefix="bench_fila_")
+            try:
+                t0 = time.perf_counter()
+                fila = None
+                for pag in pags:
+                    if fila is None:
+                        fila = robo.FilaDownload(_SemNavegador(), workers=workers)
+                    for p in pag:
+                        time.sleep(clique)
+                        b = os.path.basename(p)
+                        fila.enviar(url + b, os.path.join(dest, b))
+                    if nome == "por_pagina":
+                        fila.fechar()
+                        fila = None
+                if fila is not None:
+                    fila.fechar()
+                out[f"{nome}_s"] = round(time.perf_counter() - t0, 3)
+            finally:
+                shutil.rmtree(dest, ignore_errors=True)
+        out["ganho"] = round(out["por_pagina_s"] / out["global_s"], 2)
+        return out
+    finally:
+        srv.terminate()
+
+
+def bench_portal(n, latencia, erro, workers=1):
+    """
+    Robô inteiro (Edge headless) contra bench.portal: páginas, popovers e
+    downloads; workers > 1 usa a coleta paralela fatiada por mês.
+    """
+    from .portal import Portal, servir
+
+    srv, url = servir(Portal(n, latencia=latencia, latencia_dl=latencia / 10, erro=erro))
+    dest = tempfile.mkdtemp(prefix="bench_portal_")
+    original = robo.URL_PORTAL
+    robo._apontar_portal(url)
+    try:
+        t0 = time.perf_counter()
+        st = robo.run_download(
+            dest, "01/01/2024", "31/12/2024", "RECEBIDAS", False, False,
+            workers=workers, fatia="mes",
+            nav={"headless": True, "cookies": [{"name": "bench", "value": "1"}],
+                 "exigir_login": True},
+        )
+        xmls = len(os.listdir(os.path.join(dest, "Recebidas", "XML")))
+        if st and st.get("erro") and not xmls:  # sem selenium/Edge
+            return {"ignorado": st["erro"]}
+        r = _resumo(n, time.perf_counter() - t0)
+        r["status"] = st
+        r["xmls"] = xmls
+        r["workers"] = workers
+        return r
+    finally:
+        robo._apontar_portal(original)
+        srv.shutdown()
+        shutil.rmtree(dest, ignore_errors=True)
+
+
+def bench_paralelo(n, latencia, erro, workers):
+    """Mesmo corpus no portal falso com 1 e com `workers` navegadores."""
+    um = bench_portal(n, latencia, erro, 1)
+    if "ignorado" in um:
+        return um
+    varios = bench_portal(n, latencia, erro, workers)
+    return {"1": um, str(workers): varios,
+            "speedup": round(um["total_s"] / varios["total_s"], 2)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    ap.add_argument("--n", type=int, default=2000, help="notas no corpus")
+    ap.add_argument("--semente", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=None, help="processos do relatório")
+    ap.add_argument("--dl-workers", type=int, default=robo.DL_WORKERS)
+    ap.add_argument("--dl-async", type=int, default=robo.DL_ASYNC,
+                    help="downloads simultâneos do motor async")
+    ap.add_argument("--teto-mb", type=float, default=None,
+                    help="pico de RSS máximo do relatório (etapa memoria); "
+                         "acima dele o bench sai com código 1")
+    ap.add_argument("--teto-ms", type=float, default=None,
+                    help="tempo máximo do import do robô (etapa importacao); "
+                         "acima dele o bench sai com código 1")
+    ap.add_argument("--pasta", help="mantém o corpus nesta pasta")
+    ap.add_argument("--saida", help="JSON de resultados (padrão: bench_<data>.json)")
+    ap.add_argument("--latencia", type=float, default=0.05,
+                    help="s por página do portal falso (etapa portal)")
+    ap.add_argument("--erro", type=float, default=0.0,
+                    help="fração de respostas com erro do portal falso")
+    etapas = ("importacao", "extrair", "xml", "linhas", "excel", "excel_pandas",
+              "memoria", "baixar", "baixar_async", "fila")
+    ap.add_argument("--clique", type=float, default=0.02,
+                    help="s por popover na coleta simulada (etapa fila)")
+    ap.add_argument("--atraso-dl", type=float, default=0.12,
+                    help="s por download do servidor local (etapa fila)")
+    ap.add_argument("--navegadores", type=int, default=4,
+                    help="navegadores da etapa portal_paralelo")
+    ap.add_argument("--so", nargs="+", choices=etapas + ("portal", "portal_paralelo"),
+                    default=etapas,
+                    help="portal e portal_paralelo (Edge headless) só rodam se pedidos")
+    a = ap.parse_args(argv)
+
+    base = a.pasta or tempfile.mkdtemp(prefix="bench_nfse_")
+    res = {
+        "quando": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "n": a.n,
+        "semente": a.semente,
+        "resultados": {},
+    }
+    try:
+        t0 = time.perf_counter()
+        paths = gerar(base, a.n, a.semente)
+        res["corpus_s"] = round(time.perf_counter() - t0, 3)
+        etapas = {
+            "importacao": lambda: bench_importacao(a.teto_ms),
+            "extrair": lambda: bench_extrair(paths),
+            "xml": lambda: bench_xml(paths),
+            "linhas": lambda: bench_linhas(base, paths),
+            "excel": lambda: bench_excel(base, a.n, a.workers),
+            "excel_pandas": lambda: bench_excel_pandas(base, a.n, a.workers),
+            "memoria": lambda: bench_memoria(a.n, a.semente, a.workers, a.teto_mb),
+            "baixar": lambda: bench_baixar(paths, "threads", a.dl_workers),
+            "baixar_async": lambda: bench_baixar(paths, "async", a.dl_async),
+            "fila": lambda: bench_fila(paths, a.dl_workers, a.clique, a.atraso_dl),
+            "portal": lambda: bench_portal(a.n, a.latencia, a.erro),
+            "portal_paralelo": lambda: bench_paralelo(a.n, a.latencia, a.erro,
+                                                      a.navegadores),
+        }
+        for nome in a.so:
+            try:
+                res["resultados"][nome] = etapas[nome]()
+            except ImportError as e:
+                res["resultados"][nome] = {"ignorado": f"dependência ausente: {e.name}"}
+            print(f"{nome}: {json.dumps(res['resultados'][nome], ensure_ascii=False)}")
+    finally:
+        if not a.pasta:
+            shutil.rmtree(base, ignore_errors=True)
+
+    saida = a.saida or f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False, indent=2)
+    print(f"→ {saida}")
+    return 1 if any(r.get("ok") is False for r in res["resultados"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de corpus sintético de NFS-e: N XMLs com as variantes de tag que
+extrair_xml trata (namespace, prest/emit, toma/tomador, tribMun/BM,
+tribFed com ou sem piscofins, assinaturas xmldsig), mais o log_notas.csv
+que gerar_excel lê.
+"""
+
+import os
+import re
+import base64
+import random
+
+NS = "http://www.sped.fazenda.gov.br/nfse"
+
+
+def _v(rnd, a=10, b=50000):
+    return f"{rnd.uniform(a, b):.2f}"
+
+
+def _assinatura(ref, semente):
+    """Bloco xmldsig como o do portal (o certificado é o grosso do arquivo)."""
+    r = random.Random(semente)
+    b64 = lambda n: base64.b64encode(r.randbytes(n)).decode()  # noqa: E731
+    alg = "http://www.w3.org/2000/09/xmldsig#"
+    c14n = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+    return (
+        f'<Signature xmlns="{alg}"><SignedInfo>'
+        f'<CanonicalizationMethod Algorithm="{c14n}"/>'
+        '<SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/>'
+        f'<Reference URI="#{ref}"><Transforms>'
+        f'<Transform Algorithm="{alg}enveloped-signature"/>'
+        f'<Transform Algorithm="{c14n}"/></Transforms>'
+        '<DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+        f"<DigestValue>{b64(32)}</DigestValue></Reference></SignedInfo>"
+        f"<SignatureValue>{b64(256)}</SignatureValue><KeyInfo><X509Data>"
+        f"<X509Certificate>{b64(1400)}</X509Certificate>"
+        "</X509Data></KeyInfo></Signature>"
+    )
+
+
+def nota(i, rnd):
+    """(chave de 50 dígitos, XML) da i-ésima nota."""
+    chave = f"{rnd.randint(10**49, 10**50 - 1)}"
+    ns = f' xmlns="{NS}"' if rnd.random() < 0.8 else ""
+    pr = rnd.choice(("prest", "emit"))
+    tm = rnd.choice(("toma", "tomador"))
+    # carteira fixa de 97 prestadores e 53 tomadores, como num cliente real
+    doc = (f"<CNPJ>{10**13 + i % 53 * 104729}</CNPJ>" if i % 53 % 4
+           else f"<CPF>{10**10 + i % 53 * 7919}</CPF>")
+    vs = rnd.uniform(100, 50000)
+    aliq = rnd.choice((2.0, 3.0, 5.0))
+    tp_iss = rnd.choice("1123")
+    if rnd.random() < 0.5:
+        trib_mun = (f"<tribMun><tribISSQN>1</tribISSQN><pAliq>{aliq:.2f}</pAliq>"
+                    f"<tpRetISSQN>{tp_iss}</tpRetISSQN></tribMun>")
+    else:
+        trib_mun = (f"<BM><pAliq>{aliq:.2f}</pAliq><vISS>{vs * aliq / 100:.2f}</vISS>"
+                    f"<tpRetISSQN>{tp_iss}</tpRetISSQN></BM>")
+    pc = ""
+    if rnd.random() < 0.6:
+        pc = (f"<piscofins><CST>0{rnd.randint(0, 9)}</CST>"
+              f"<vBCPisCofins>{vs:.2f}</vBCPisCofins><pAliqPis>0.65</pAliqPis>"
+              f"<pAliqCofins>3.00</pAliqCofins><vPis>{vs * .0065:.2f}</vPis>"
+              f"<vCofins>{vs * .03:.2f}</vCofins>"
+              f"<tpRetPisCofins>{rnd.choice('12')}</tpRetPisCofins></piscofins>")
+    fed = ""
+    if pc or rnd.random() < 0.4:
+        fed = (f"<tribFed>{pc}<vRetCP>{_v(rnd, 0, 500)}</vRetCP>"
+               f"<vRetIRRF>{_v(rnd, 0, 500)}</vRetIRRF>"
+               f"<vRetCSLL>{_v(rnd, 0, 300)}</vRetCSLL>"
+               + (f"<vRetINSS>{_v(rnd, 0, 800)}</vRetINSS>" if rnd.random() < 0.3 else "")
+               + "</tribFed>")
+    mes = rnd.randint(1, 12)
+    dia = rnd.randint(1, 28)
+    xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<NFSe{ns} versao="1.00"><infNFSe Id="NFS{chave}">
+<xLocEmi>São Paulo</xLocEmi><xLocPrestacao>São Paulo</xLocPrestacao>
+<nNFSe>{i + 1}</nNFSe><xLocIncid>São Paulo</xLocIncid>
+<dhProc>2024-{mes:02d}-{dia:02d}T12:00:00-03:00</dhProc><nDFSe>{i + 1}</nDFSe>
+<{pr}><CNPJ>{2 * 10**13 + i % 97 * 104723}</CNPJ><xNome>Prestador {i % 97} Ltda</xNome></{pr}>
+<valores><vCalcDR>0.00</vCalcDR><vBC>{vs:.2f}</vBC><pAliqAplic>{aliq:.2f}</pAliqAplic>
+<vISSQN>{vs * aliq / 100:.2f}</vISSQN><vLiq>{vs * 0.9:.2f}</vLiq></valores>
+<DPS versao="1.00"><infDPS Id="DPS{chave[:42]}">
+<dhEmi>2024-{mes:02d}-{dia:02d}T10:00:00-03:00</dhEmi><dCompet>2024-{mes:02d}-01</dCompet>
+<{tm}>{doc}<xNome>Tomador {i % 53} S/A</xNome></{tm}>
+<serv><cServ><cTribNac>{rnd.choice(('010101', '070201', '171901', '140101'))}</cTribNac>
+<xDescServ>Serviço prestado nº {i + 1} conforme contrato</xDescServ></cServ></serv>
+<valores><vServPrest><vServ>{vs:.2f}</vServ></vServPrest>
+<vDescCondIncond><vDescIncond>{_v(rnd, 0, 50)}</vDescIncond><vDescCond>0.00</vDescCond></vDescCondIncond>
+<trib>{trib_mun}{fed}</trib></valores>
+</infDPS>{_assinatura("DPS" + chave[:42], chave + "d")}</DPS></infNFSe>
+{_assinatura("NFS" + chave, chave)}</NFSe>
+"""
+    return chave, xml
+
+
+def casos_xml():
+    """
+    [(nome, bytes)] de XMLs fora do padrão do corpus, para conferir que os
+    motores de extrair_xml (lxml e xml.etree) extraem o mesmo.
+    """
+    _, base = nota(0, random.Random(7))
+    casos = [
+        ("prefixo", base.replace("<NFSe", "<n:NFSe xmlns:n='urn:x'")
+         .replace("</NFSe>", "</n:NFSe>")),
+        ("comentario", base.replace("<vLiq>", "<vLiq><!-- c -->1<?pi x?>")),
+        ("cdata", base.replace("<xNome>Prestador", "<xNome><![CDATA[A & B]]> Prestador")),
+        ("aninhado", base.replace(
+            "<valores><vCalcDR>",
+            "<valores><valores><vBC>1.00</vBC></valores><vCalcDR>", 1)),
+        ("entidade", base.replace(
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE NFSe [<!ENTITY e "ent">]>',
+        ).replace("<xLocPrestacao>São Paulo", "<xLocPrestacao>&e;")),
+        ("id_prefixado", base.replace(' Id="NFS', ' xmlns:a="urn:a" a:Id="NFS')),
+        ("vazios", re.sub(r"<(vBC|vISSQN)>[^<]*<", r"<\1>  <", base)),
+        ("truncado", base[: len(base) // 2]),
+    ]
+    out = [(n, x.encode("utf-8")) for n, x in casos]
+    out.append(("latin1", base.replace('encoding="UTF-8"', 'encoding="ISO-8859-1"')
+                .encode("latin-1")))
+    out.append(("bom", b"\xef\xbb\xbf" + base.encode("utf-8")))
+    return out
+
+
+def gerar(base, n, semente=0, tipo="Recebidas"):
+    """
+    Grava n notas em base/<tipo>/XML/<chave>.xml e o log_notas.csv
+    correspondente. Retorna a lista de caminhos dos XMLs.
+    """
+    import EXTRAIR_NFSe_FINAL_OCR as robo
+
+    rnd = random.Random(semente)
+    xdir = os.path.join(base, tipo, "XML")
+    os.makedirs(xdir, exist_ok=True)
+    os.makedirs(os.path.join(base, tipo, "PDF"), exist_ok=True)
+    paths, logs = [], []
+    for i in range(n):
+        chave, xml = nota(i, rnd)
+        p = os.path.join(xdir, f"{chave}.xml")
+        with open(p, "w", encoding="utf-8") as f:
+            f.write(xml)
+        paths.append(p)
+        logs.append(robo._Log(
+            PAGINA=i // 15 + 1, LINHA=i % 15 + 1, NUMERO_NFSE=str(i + 1),
+            CHAVE=chave, XML=f"{chave}.xml", PDF="",
+            SITUACAO="Cancelada" if rnd.random() < 0.03 else "Emitida",
+            TIPO=tipo,
+        ))
+    robo._gravar_log_csv(os.path.join(base, tipo, "log_notas.csv"), logs)
+    return paths
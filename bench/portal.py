@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Portal falso para rodar o laço de páginas offline (Edge headless aponta
+para ele com `download --portal http://127.0.0.1:8765/EmissorNacional/`).
+
+    python -m bench.portal --n 300 --latencia 0.15 --erro 0.02
+    python -m bench.portal --gravacao gravado/ --xmls C:/NFSe
+
+Sem --gravacao as páginas são sintéticas (notas de bench.corpus, filtradas
+pelas datas do formulário, paginação ?pg=N). Com --gravacao reproduz o HTML
+salvo por `download --gravar` (pasta/<tipo>/<fatia>/pNNNN.html e os
+popovers pNNNN_lNNN.popover.html); a fatia segue a última data filtrada, o
+que vale para um navegador por vez. Latência e injeção de erro valem para os
+dois modos.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .corpus import nota
+
+RAIZ = "/EmissorNacional/"
+TIPOS = ("Recebidas", "Emitidas")
+PDF = b"%PDF-1.4\n" + b"%" * 200 + b"\n%%EOF\n"
+
+# Popover: sintético usa data-pop da linha (índice, não a chave, para não
+# vazar links com --sem-links); gravado, a posição da linha na tabela
+_JS = """<script>
+document.addEventListener('click',function(e){
+  var a=e.target.closest&&e.target.closest('a.icone-trigger');
+  if(!a) return;
+  e.preventDefault();
+  document.querySelectorAll('.popover').forEach(function(p){p.remove();});
+  var u=a.getAttribute('data-pop');
+  if(!u){
+    var rs=[].filter.call(document.querySelectorAll('table tbody tr'),
+      function(r){return r.querySelector('a.icone-trigger');});
+    u='/_replay/popover?tipo='+REPLAY.tipo+'&f='+REPLAY.f+'&pg='+REPLAY.pg
+      +'&l='+(rs.indexOf(a.closest('tr'))+1);
+  }
+  fetch(u).then(function(r){return r.text();}).then(function(h){
+    var d=document.createElement('div');d.innerHTML=h;
+    if(d.firstElementChild) document.body.appendChild(d.firstElementChild);
+  });
+});
+</script>"""
+
+
+def _data(txt):
+    try:
+        return datetime.strptime(txt, "%d/%m/%Y").date()
+    except (TypeError, ValueError):
+        return None
+
+
+class Portal:
+    def __init__(self, n=300, semente=0, por_pagina=15, latencia=0.0,
+                 latencia_dl=0.0, erro=0.0, links=True, gravacao=None, xmls=None):
+        self.por_pagina = por_pagina
+        self.latencia, self.latencia_dl, self.erro = latencia, latencia_dl, erro
+        self.links = links
+        self.gravacao, self.xmls = gravacao, xmls
+        self.fatia = {}  # replay: tipo -> fatia da última filtragem
+        self.notas, self.xml = {}, {}
+        rnd = random.Random(semente)
+        for t in TIPOS:
+            lst = []
+            for i in range(n):
+                chave, xml = nota(i, rnd)
+                m = re.search(r"<dhEmi>(\d{4})-(\d{2})-(\d{2})", xml)
+                lst.append({
+                    "chave": chave, "num": str(i + 1),
+                    "data": datetime(int(m[1]), int(m[2]), int(m[3])).date(),
+                    "sit": "cancelada" if rnd.random() < 0.03 else "gerada",
+                })
+                self.xml[chave] = xml.encode("utf-8")
+            lst.sort(key=lambda x: x["data"], reverse=True)
+            self.notas[t] = lst
+
+    # ── latência / erro ──
+    def esperar(self, base):
+        if base:
+            time.sleep(random.uniform(base * 0.5, base * 1.5))
+
+    def falhar(self):
+        return self.erro and random.random() < self.erro
+
+    # ── páginas ──
+    def login(self):
+        return f"<html><script>location.replace('{RAIZ}Dashboard')</script></html>"
+
+    def dashboard(self):
+        return (
+            "<html><body><h1>Dashboard</h1>"
+            f"<a href='{RAIZ}Notas/Recebidas'><img src='/img/menu-recebidas.png'>Recebidas</a>"
+            f"<a href='{RAIZ}Notas/Emitidas'><img src='/img/menu-emitidas.png'>Emitidas</a>"
+            "</body></html>"
+        )
+
+    def tabela(self, tipo, q):
+        if self.gravacao:
+            return self._gravada(tipo, q)
+        di = _data(q.get("datainicio"))
+        df = _data(q.get("datafim"))
+        pg = max(1, int(q.get("pg") or 1))
+        notas = [
+            (i, x) for i, x in enumerate(self.notas[tipo])
+            if (not di or x["data"] >= di) and (not df or x["data"] <= df)
+        ]
+        ini = (pg - 1) * self.por_pagina
+        fatia = notas[ini:ini + self.por_pagina]
+        filtro = f"datainicio={q.get('datainicio', '')}&datafim={q.get('datafim', '')}"
+        linhas = []
+        for i, x in fatia:
+            k = x["chave"]
+            lk = (
+                f"<span hidden><a href='{RAIZ}Notas/Download/NFSe/{k}'>XML</a>"
+                f"<a href='{RAIZ}Notas/Download/DANFSe/{k}'>PDF</a></span>"
+                if self.links else ""
+            )
+            linhas.append(
+                f"<tr><td>{x['num']}</td><td>{x['data']:%d/%m/%Y}</td>"
+                f"<td><img src='/img/tb-{x['sit']}.png'></td>"
+                f"<td><a class='icone-trigger' href='#' "
+                f"data-pop='/_replay/popover?t={tipo}&i={i}'>&#8942;</a>{lk}</td></tr>"
+            )
+        corpo = "".join(linhas) or "<tr><td>Nenhum registro encontrado</td></tr>"
+        ult = max(1, -(-len(notas) // self.por_pagina))
+        prox = (
+            "<li class='disabled'><a title='Próxima'>&rsaquo;</a></li>" if pg >= ult else
+            f"<li><a href='{RAIZ}Notas/{tipo}?pg={pg + 1}&{filtro}' "
+            f"title='Próxima'>&rsaquo;</a></li>"
+        )
+        paginas = "".join(
+            f"<li{' class=active' if p == pg else ''}>"
+            f"<a href='{RAIZ}Notas/{tipo}?pg={p}&{filtro}'>{p}</a></li>"
+            for p in range(max(1, pg - 2), min(ult, pg + 2) + 1)
+        )
+        return (
+            f"<html><body><form method='get' action='{RAIZ}Notas/{tipo}'>"
+            f"<input id='datainicio' name='datainicio' value='{escape(q.get('datainicio', ''))}'>"
+            f"<input id='datafim' name='datafim' value='{escape(q.get('datafim', ''))}'>"
+            "<button type='submit'>Filtrar</button></form>"
+            f"<table><tbody>{corpo}</tbody></table>"
+            f"<ul class='pagination'>{paginas}{prox}</ul>{_JS}</body></html>"
+        )
+
+    def _gravada(self, tipo, q):
+        ini = next((v for k, v in q.items() if "inicio" in k.lower() and v), None)
+        pasta = os.path.join(self.gravacao, tipo)
+        fatias = sorted(os.listdir(pasta)) if os.path.isdir(pasta) else []
+        if ini and _data(ini):
+            tag = _data(ini).strftime("%Y%m%d")
+            self.fatia[tipo] = tag if tag in fatias else (fatias[0] if fatias else "")
+        f = self.fatia.get(tipo) or (fatias[0] if fatias else "")
+        pg = max(1, int(q.get("pg") or 1))
+        arq = os.path.join(pasta, f, f"p{pg:04d}.html")
+        if not os.path.isfile(arq):
+            return "<html><body><table><tbody></tbody></table>Nenhum registro encontrado</body></html>"
+        with open(arq, encoding="utf-8") as fh:
+            html = fh.read()
+        js = f"<script>var REPLAY={{tipo:'{tipo}',f:'{f}',pg:{pg}}};</script>{_JS}"
+        i = html.lower().rfind("</body>")
+        return html[:i] + js + html[i:] if i >= 0 else html + js
+
+    def popover(self, q):
+        if q.get("i"):
+            k = self.notas[q.get("t", TIPOS[0])][int(q["i"])]["chave"]
+            return (
+                "<div class='popover'>"
+                f"<a href='{RAIZ}Notas/Download/NFSe/{k}'>Download XML</a>"
+                f"<a href='{RAIZ}Notas/Download/DANFSe/{k}'>Download DANFSe</a></div>"
+            )
+        arq = os.path.join(
+            self.gravacao or "", q.get("tipo", ""), q.get("f", ""),
+            f"p{int(q.get('pg') or 0):04d}_l{int(q.get('l') or 0):03d}.popover.html",
+        )
+        if os.path.isfile(arq):
+            with open(arq, encoding="utf-8") as fh:
+                return fh.read()
+        return "<div class='popover'></div>"
+
+    def arquivo(self, qual, k):
+        if qual == "NFSe":
+            if self.xmls:
+                for t in TIPOS:
+                    p = os.path.join(self.xmls, t, "XML", f"{k}.xml")
+                    if os.path.isfile(p):
+                        with open(p, "rb") as fh:
+                            return fh.read(), "application/xml"
+            corpo = self.xml.get(k)
+            return (corpo, "application/xml") if corpo else (None, None)
+        return PDF, "application/pdf"
+
+
+def _handler(portal):
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *_):
+            pass
+
+        def _enviar(self, status, corpo, tipo="text/html; charset=utf-8"):
+            if isinstance(corpo, str):
+                corpo = corpo.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            form = self.rfile.read(n).decode("utf-8", "replace")
+            self.do_GET(form)
+
+        def do_GET(self, form=""):
+            u = urlsplit(self.path)
+            q = {k: v[-1] for k, v in parse_qs(u.query + "&" + form).items()}
+            rota = u.path
+            m = re.match(re.escape(RAIZ) + r"Notas/Download/(NFSe|DANFSe)/(?:NFS)?(\w+)", rota)
+            if m:
+                portal.esperar(portal.latencia_dl)
+                if portal.falhar():
+                    return self._enviar(500, "erro")
+                corpo, tipo = portal.arquivo(m[1], m[2])
+                return self._enviar(200, corpo, tipo) if corpo else self._enviar(404, "")
+            if rota.startswith("/_replay/popover"):
+                portal.esperar(portal.latencia / 3)
+                return self._enviar(200, portal.popover(q))
+            if rota == RAIZ + "Login":
+                return self._enviar(200, portal.login())
+            if rota in (RAIZ, RAIZ + "Dashboard"):
+                return self._enviar(200, portal.dashboard())
+            m = re.match(re.escape(RAIZ) + r"Notas/(Recebidas|Emitidas)$", rota)
+            if m:
+                portal.esperar(portal.latencia)
+                if portal.falhar():
+                    return self._enviar(
+                        200, "<html><body>Ocorreu um erro. Tente novamente.</body></html>"
+                    )
+                return self._enviar(200, portal.tabela(m[1], q))
+            return self._enviar(404, "")
+
+    return H
+
+
+def servir(portal, porta=0):
+    """Sobe o portal numa thread; devolve (servidor, URL base do portal)."""
+    srv = ThreadingHTTPServer(("127.0.0.1", porta), _handler(portal))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}{RAIZ}"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.portal", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--porta", type=int, default=8765)
+    ap.add_argument("--n", type=int, default=300, help="notas sintéticas por tipo")
+    ap.add_argument("--semente", type=int, default=0)
+    ap.add_argument("--por-pagina", type=int, default=15)
+    ap.add_argument("--latencia", type=float, default=0.0, help="s por página")
+    ap.add_argument("--latencia-dl", type=float, default=0.0, help="s por download")
+    ap.add_argument("--erro", type=float, default=0.0, help="fração de respostas com erro")
+    ap.add_argument("--sem-links", action="store_true",
+                    help="links só no popover (força o caminho lento)")
+    ap.add_argument("--gravacao", help="pasta gravada por `download --gravar`")
+    ap.add_argument("--xmls", help="pasta base com <tipo>/XML/<chave>.xml para servir")
+    a = ap.parse_args(argv)
+    portal = Portal(a.n, a.semente, a.por_pagina, a.latencia, a.latencia_dl, a.erro,
+                    not a.sem_links, a.gravacao, a.xmls)
+    srv, url = servir(portal, a.porta)
+    print(f"Portal em {url}  (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())